@@ -0,0 +1,424 @@
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from apps.manga.create_index import index_all_mangas, manga_indexer
+from apps.manga.browser import driver_pool
+from apps.manga.downloader import download_image
+from apps.manga.extraction import (parse_category_page, parse_chapters, parse_details_page, parse_page_count,
+                                   parse_page_image)
+from apps.manga.http_cache import response_cache
+from apps.manga.models import Author, Genre, Manga
+from apps.manga.search import author_names, autocomplete_cache, filter_cache, result_cache, searcher_cache
+
+# Constants
+GENRE_NAMES = [
+    'Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Horror', 'Josei', 'Martial Arts', 'Mecha', 'Mystery',
+    'Psychological', 'Romance', 'School Life', 'Sci-fi', 'Seinen', 'Shoujo', 'Shounen', 'Slice of Life', 'Sports',
+    'Supernatural', 'Tragedy', 'Historical', 'Music', 'Cooking',
+]
+TITLE_WORDS = [
+    'blade', 'moon', 'dragon', 'school', 'hero', 'night', 'spirit', 'kingdom', 'shadow', 'flower', 'sky', 'demon',
+    'love', 'ghost', 'iron', 'star', 'ocean', 'tale', 'hunter', 'sword', 'city', 'dream', 'fire', 'winter',
+]
+BATCH_SIZE = 5000
+MANGAS_PER_AUTHOR = 5
+REQUESTS_PER_SCENARIO = 30
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+EXTRACTION_REPEAT = 20
+READER_PAGE_MARKER = 'manga_pic'
+BROWSER_PAGES = 5
+SCENARIOS = {
+    'all': ('list_all_mangas', {}),
+    'deep_page': ('list_all_mangas', {'page': 40}),
+    'one_genre': ('list_all_mangas', {'genre': 'Action'}),
+    'genres_and_decade': ('list_all_mangas', {'genre': 'Romance,Comedy', 'start_year': 1990, 'end_year': 1999}),
+    'title': ('list_all_mangas', {'title': 'dragon'}),
+    'title_and_author': ('list_all_mangas', {'title': 'moon', 'author': 'author 1'}),
+    'most_viewed': ('list_all_mangas', {'sort': 'views'}),
+    'newest_in_genre': ('list_all_mangas', {'sort': 'year', 'genre': 'Fantasy'}),
+    'autocomplete': ('autocomplete', {'q': 'dra'}),
+}
+
+
+def parse_scale(scale):
+    """
+    Converts a scale name such as '10k' or a plain number into a number of mangas.
+
+    Parameters:
+        scale (str): The scale name or number.
+
+    Returns:
+        int: The number of mangas.
+    """
+    return SCALES.get(scale.lower()) or int(scale)
+
+
+def generate_catalogue(num_mangas, seed=0):
+    """
+    Replaces the catalogue with a synthetic one of the given size, written with bulk inserts.
+
+    Titles are made of common words so text queries match many mangas, views follow a long-tailed distribution and
+    every manga gets between one and four genres.
+
+    Parameters:
+        num_mangas (int): The number of mangas to create. Authors are created one per MANGAS_PER_AUTHOR mangas.
+        seed (int, optional): The seed of the random generator, so catalogues are reproducible. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    Manga.objects.all().delete()
+    Author.objects.all().delete()
+    Genre.objects.all().delete()
+
+    genres = Genre.objects.bulk_create(Genre(id=i + 1, name=name) for i, name in enumerate(GENRE_NAMES))
+    num_authors = max(1, num_mangas // MANGAS_PER_AUTHOR)
+    Author.objects.bulk_create(
+        (Author(id=i + 1, name=f'Author {i}') for i in range(num_authors)), batch_size=BATCH_SIZE
+    )
+
+    through = Manga.genres.through
+    for start in range(0, num_mangas, BATCH_SIZE):
+        mangas = []
+        links = []
+        for manga_id in range(start + 1, min(start + BATCH_SIZE, num_mangas) + 1):
+            title = ' '.join(rng.sample(TITLE_WORDS, 3)).title()
+            mangas.append(Manga(
+                id=manga_id,
+                title=f'{title} {manga_id}',
+                author_id=rng.randint(1, num_authors),
+                release_year=rng.randint(1960, 2024),
+                image_link='assets/img/default-avatar.png',
+                details_link=f'https://example.com/manga/{manga_id}.html',
+                num_caps=rng.randint(1, 1000),
+                views=int(rng.lognormvariate(8, 2)),
+            ))
+            for genre in rng.sample(genres, rng.randint(1, 4)):
+                links.append(through(manga_id=manga_id, genre_id=genre.id))
+        Manga.objects.bulk_create(mangas)
+        through.objects.bulk_create(links)
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values fall (nearest rank).
+
+    Parameters:
+        values (List[float]): The sorted values.
+        fraction (float): The fraction, between 0 and 1.
+
+    Returns:
+        float: The percentile.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure_requests(client, url, params, repeat, cached):
+    """
+    Times repeated requests to a view and counts their database queries.
+
+    Parameters:
+        client (django.test.Client): The client to send the requests with.
+        url (str): The path of the view.
+        params (dict): The GET parameters.
+        repeat (int): The number of requests.
+        cached (bool): Whether the search caches are kept between requests; otherwise every request is a miss.
+
+    Returns:
+        dict: The latency percentiles in milliseconds and the maximum number of queries per request.
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        if not cached:
+            result_cache.clear()
+            filter_cache.clear()
+            autocomplete_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(url, params)
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} {params} answered {response.status_code}")
+        queries = max(queries, len(context.captured_queries))
+    timings.sort()
+    return {
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p90_ms': round(percentile(timings, 0.9), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'max_ms': round(timings[-1], 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'queries': queries,
+    }
+
+
+def benchmark_scale(num_mangas, procs=1, repeat=REQUESTS_PER_SCENARIO, seed=0):
+    """
+    Generates a synthetic catalogue, indexes it into a temporary directory and measures every scenario.
+
+    Must run against a disposable database, as the catalogue is replaced.
+
+    Parameters:
+        num_mangas (int): The number of mangas of the catalogue.
+        procs (int, optional): The number of indexing processes. Defaults to 1.
+        repeat (int, optional): The number of requests per scenario. Defaults to REQUESTS_PER_SCENARIO.
+        seed (int, optional): The seed of the synthetic catalogue. Defaults to 0.
+
+    Returns:
+        dict: The generation and indexing times and the measures of each scenario, cached and uncached.
+    """
+    start = time.perf_counter()
+    # The synthetic catalogue must not reach the real index through the signals
+    with manga_indexer.suspended():
+        generate_catalogue(num_mangas, seed)
+    generate_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as index_path:
+        start = time.perf_counter()
+        index_all_mangas(index_path, procs=procs)
+        index_seconds = time.perf_counter() - start
+
+        searcher_cache.reset(index_path)
+        for cache in (result_cache, filter_cache, autocomplete_cache, author_names):
+            cache.clear()
+        client = Client()
+        scenarios = {}
+        try:
+            for name, (url, params) in SCENARIOS.items():
+                scenarios[name] = {
+                    'uncached': measure_requests(client, f'/{url}', params, repeat, cached=False),
+                    'cached': measure_requests(client, f'/{url}', params, repeat, cached=True),
+                }
+                logging.info(f"{num_mangas} mangas, {name}: {scenarios[name]}")
+        finally:
+            searcher_cache.reset()
+
+    return {
+        'mangas': num_mangas,
+        'generate_seconds': round(generate_seconds, 3),
+        'index_seconds': round(index_seconds, 3),
+        'index_procs': procs,
+        'index_mangas_per_second': round(num_mangas / index_seconds, 1),
+        'scenarios': scenarios,
+    }
+
+
+def bs4_parse_category_page(html):
+    """
+    The previous extraction of category pages, building a full BeautifulSoup tree, kept as the benchmark baseline.
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    entries = []
+    for manga in soup.find('ul', class_='direlist').find_all('dl', 'bookinfo'):
+        entries.append({
+            'title': manga.find('a', class_='bookname').text,
+            'details_link': manga.find('a', class_='bookname')['href'],
+            'image_url': manga.find('img')['src'],
+            'views': int(manga.find('span').text.replace('views', '').replace(',', '').strip()),
+        })
+    return entries
+
+
+def bs4_parse_details_page(html):
+    """
+    The previous extraction of details pages, building a full BeautifulSoup tree, kept as the benchmark baseline.
+    """
+    details_soup = BeautifulSoup(html, 'lxml')
+    name_author = details_soup.find('b', string='Autor(s):')
+    release_year = details_soup.find('b', string='Año')
+    names_genres = details_soup.find('li', itemprop='genre')
+    sections = details_soup.find_all('ul', class_='sub_vol_ul')
+    caps = [cap for section in sections for cap in section.find_all('a')]
+    return {
+        'author_name': name_author.find_next('a').text.strip() if name_author else None,
+        'release_year': int(release_year.find_next('a').text) if release_year else None,
+        'genre_names': [genre.text for genre in names_genres.find_all('a')] if names_genres else [],
+        'num_caps': len(caps),
+    }
+
+
+def bs4_parse_chapters(html):
+    """
+    The previous extraction of chapter lists, with html.parser, kept as the benchmark baseline.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    chapter_links = {}
+    for section in soup.find_all('ul', class_='sub_vol_ul'):
+        for chapter_element in section.find_all('li'):
+            link = chapter_element.find('a')['href']
+            num_chapters = re.findall(r'\d+(?:\.\d+)?', chapter_element.find('a')['title'])
+            if len(num_chapters) >= 1:
+                num_chapter = max(num_chapters)
+            else:
+                posible_num_chapter = min(chapter_links.keys())
+                num_chapter = posible_num_chapter - 1 if posible_num_chapter <= 0 else 0
+            chapter_links[float(num_chapter)] = link
+    return chapter_links
+
+
+EXTRACTION_CASES = {
+    'category': ('direlist', bs4_parse_category_page, parse_category_page),
+    'details': ('sub_vol_ul', bs4_parse_details_page, parse_details_page),
+    'chapters': ('sub_vol_ul', bs4_parse_chapters, parse_chapters),
+}
+
+
+def load_saved_pages(paths=()):
+    """
+    Reads saved HTML pages from files and folders or, when no path is given, from the response cache.
+
+    Parameters:
+        paths (Iterable[str], optional): HTML files and folders containing them.
+
+    Returns:
+        List[str]: The HTML of each page.
+    """
+    pages = []
+    if not paths:
+        for directory, _, files in os.walk(response_cache.path):
+            for name in files:
+                if name.endswith('.gz'):
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        header, content = gzip.decompress(f.read()).split(b'\n', 1)
+                    meta = json.loads(header)
+                    if meta['headers'].get('Content-Type', '').startswith('text/html'):
+                        pages.append(content.decode(meta['encoding'] or 'utf-8', errors='replace'))
+        return pages
+
+    for path in paths:
+        files = [path] if os.path.isfile(path) else [
+            os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names
+            if name.endswith(('.html', '.htm'))
+        ]
+        for file in files:
+            with open(file, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+    return pages
+
+
+def measure_extraction(function, pages, repeat):
+    """
+    Times an extraction function over pages and measures its peak Python allocation.
+
+    Allocations made inside C libraries, e.g. libxml2's tree, are not seen by tracemalloc.
+
+    Parameters:
+        function (Callable[[str], object]): The extraction function.
+        pages (List[str]): The pages.
+        repeat (int): The number of times each page is extracted.
+
+    Returns:
+        dict: The per-page latency in milliseconds and the largest peak allocation of a page in KB.
+    """
+    timings = []
+    for _ in range(repeat):
+        for html in pages:
+            start = time.perf_counter()
+            function(html)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    peak = 0
+    for html in pages:
+        tracemalloc.start()
+        function(html)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p90_ms': round(percentile(timings, 0.9), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'peak_python_kb': round(peak / 1024, 1),
+    }
+
+
+def benchmark_extraction(pages, repeat=EXTRACTION_REPEAT):
+    """
+    Compares the previous BeautifulSoup extraction with the lxml one over saved pages, checking they agree.
+
+    Parameters:
+        pages (List[str]): The saved pages. Each one is measured with the cases whose marker it contains.
+        repeat (int, optional): The number of times each page is extracted. Defaults to EXTRACTION_REPEAT.
+
+    Returns:
+        dict: For each case, the number of pages, the measures of both extractions, the speedup and the number of
+            pages where their results differ.
+    """
+    results = {}
+    for name, (marker, baseline, extraction) in EXTRACTION_CASES.items():
+        case_pages = [html for html in pages if marker in html]
+        if not case_pages:
+            continue
+        before = measure_extraction(baseline, case_pages, repeat)
+        after = measure_extraction(extraction, case_pages, repeat)
+        results[name] = {
+            'pages': len(case_pages),
+            'bs4': before,
+            'lxml': after,
+            'speedup': round(before['mean_ms'] / after['mean_ms'], 1),
+            'mismatches': sum(baseline(html) != extraction(html) for html in case_pages),
+        }
+        logging.info(f"{name}: {results[name]}")
+    return results
+
+
+def benchmark_page_resolution(pages, repeat=EXTRACTION_REPEAT, browser_pages=0):
+    """
+    Measures how fast the image URLs of saved reader pages are resolved from their HTML and, optionally, with the
+    browser pool used as fallback.
+
+    Parameters:
+        pages (List[str]): The saved pages. Only the ones containing READER_PAGE_MARKER are reader pages.
+        repeat (int, optional): The number of times each page is resolved. Defaults to EXTRACTION_REPEAT.
+        browser_pages (int, optional): The number of pages also resolved with the browser, loaded from temporary
+            files. Defaults to 0, since it needs Chrome.
+
+    Returns:
+        dict: The number of reader pages, how many need the browser fallback, the pages per second of each path and
+            the counters of the browser pool.
+    """
+    reader_pages = [html for html in pages if READER_PAGE_MARKER in html]
+    if not reader_pages:
+        return {}
+
+    def resolve(html):
+        return parse_page_image(html), parse_page_count(html)
+
+    static = measure_extraction(resolve, reader_pages, repeat)
+    results = {
+        'pages': len(reader_pages),
+        'fallbacks': sum(parse_page_image(html) is None for html in reader_pages),
+        'static': dict(static, pages_per_second=round(1000 / static['mean_ms'], 1)),
+    }
+
+    if browser_pages:
+        with tempfile.TemporaryDirectory() as directory:
+            links = []
+            for i, html in enumerate(reader_pages[:browser_pages]):
+                path = os.path.join(directory, f'{i}.html')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(html)
+                links.append(f'file://{path}')
+            start = time.perf_counter()
+            for i, link in enumerate(links):
+                download_image((link, 'benchmark', i))
+            seconds = time.perf_counter() - start
+        results['browser'] = {
+            'pages': len(links),
+            'pages_per_second': round(len(links) / seconds, 3),
+            'pool': driver_pool.stats(),
+        }
+        results['speedup'] = round(results['static']['pages_per_second'] / results['browser']['pages_per_second'])
+    logging.info(f"Page resolution: {results}")
+    return results
@@ -0,0 +1,173 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Constants
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 4))
+BROWSER_MAX_USES = int(os.getenv('BROWSER_MAX_USES', 50))
+BROWSER_WAIT = float(os.getenv('BROWSER_WAIT', 10))
+BROWSER_PAGE_LOAD_TIMEOUT = 30
+
+
+def browser_options() -> webdriver.ChromeOptions:
+    """
+    Returns the options of the headless browser used when a reader page cannot be read from its HTML.
+
+    Returns:
+        webdriver.ChromeOptions: The options.
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')  # Para ejecutar en segundo plano
+    return options
+
+
+def start_driver() -> webdriver.Chrome:
+    """
+    Starts a headless Chrome.
+
+    Returns:
+        webdriver.Chrome: The driver.
+    """
+    driver = webdriver.Chrome(options=browser_options())
+    driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+def wait_for_element(driver, class_name, attribute=None, timeout=BROWSER_WAIT):
+    """
+    Waits until an element with a CSS class is in the page and, if given, until it has a non-empty attribute.
+
+    Parameters:
+        driver (webdriver.Remote): The driver.
+        class_name (str): The CSS class.
+        attribute (str, optional): The attribute that must be set, e.g. 'src'.
+        timeout (float, optional): The seconds to wait. Defaults to BROWSER_WAIT.
+
+    Returns:
+        WebElement: The element.
+
+    Raises:
+        selenium.common.exceptions.TimeoutException: If the element does not appear in time.
+    """
+    def present(driver):
+        element = driver.find_element(By.CLASS_NAME, class_name)
+        return element if attribute is None or element.get_attribute(attribute) else False
+
+    return WebDriverWait(driver, timeout).until(present)
+
+
+class DriverPool:
+    """
+    A bounded pool of long-lived headless browsers shared by all the threads that need one.
+
+    At most `size` drivers exist at a time and a thread waits for a free one, so Chrome starts once per slot instead
+    of once per page. A driver is checked before it is handed out and whenever its user fails, and it is replaced
+    when it stops answering or after `max_uses` pages, so leaks in long browser sessions do not pile up.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES, factory=start_driver):
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory
+        self.started = 0
+        self.recycled = 0
+        self.uses = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._driver_uses = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def driver(self):
+        """
+        Lends a driver for the duration of a block, waiting for one if all of them are in use.
+
+        Yields:
+            webdriver.Remote: The driver.
+        """
+        with self._slots:
+            driver = self._take()
+            healthy = True
+            try:
+                yield driver
+            except BaseException:
+                # Un fallo de la página no invalida el navegador, solo se descarta si ha dejado de responder
+                healthy = self._alive(driver)
+                raise
+            finally:
+                self._give_back(driver, healthy)
+
+    def stats(self):
+        """
+        Returns the usage counters of the pool.
+
+        Returns:
+            dict: The drivers started, the drivers recycled, the pages served and the idle drivers.
+        """
+        return {'started': self.started, 'recycled': self.recycled, 'uses': self.uses, 'idle': self._idle.qsize()}
+
+    def close(self):
+        """
+        Quits the idle drivers. Drivers in use are quit when they are given back.
+        """
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(driver)
+
+    def _take(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._alive(driver):
+                return driver
+            logging.warning("Browser stopped answering, starting a new one")
+            self._quit(driver)
+        driver = self.factory()
+        with self._lock:
+            self.started += 1
+            self._driver_uses[driver] = 0
+        return driver
+
+    def _give_back(self, driver, healthy):
+        with self._lock:
+            self.uses += 1
+            self._driver_uses[driver] += 1
+            worn = self._driver_uses[driver] >= self.max_uses
+        if healthy and not worn:
+            self._idle.put(driver)
+            return
+        with self._lock:
+            self.recycled += 1
+        self._quit(driver)
+
+    def _alive(self, driver):
+        try:
+            driver.current_url
+            return True
+        # Si el proceso de chromedriver ha muerto, el error llega de urllib3 y no de selenium
+        except Exception:
+            return False
+
+    def _quit(self, driver):
+        with self._lock:
+            self._driver_uses.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Error closing the browser: {e}")
+
+
+driver_pool = DriverPool()
+atexit.register(driver_pool.close)
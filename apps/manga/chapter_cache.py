@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+from io import BytesIO
+
+from apps.manga.disk_cache import DiskCache
+
+# Constants
+CHAPTER_CACHE_PATH = os.getenv('CHAPTER_CACHE_PATH', 'data/chapter_cache')
+CHAPTER_CACHE_MAX_MB = int(os.getenv('CHAPTER_CACHE_MAX_MB', 2048))
+CHAPTER_CACHE_EVICT_TO = 0.9
+
+
+def chapter_fingerprint(link):
+    """
+    Identifies the source of a chapter from its link on the manga page, so a cached chapter is found without opening
+    its reader pages. The site gives every upload its own reader link, so a chapter that is uploaded again gets a
+    new cache entry.
+
+    Parameters:
+        link (str): The chapter link.
+
+    Returns:
+        str: The fingerprint.
+    """
+    return hashlib.sha256(link.encode()).hexdigest()[:16]
+
+
+class ChapterCache(DiskCache):
+    """
+    Stores rendered chapter files on disk, keyed by manga, chapter number, output format and source fingerprint, so a
+    chapter that was already downloaded is served without scraping and rendering it again.
+
+    When the cache grows over `max_bytes`, the least recently used entries are removed until it is back to
+    CHAPTER_CACHE_EVICT_TO of the budget.
+    """
+
+    name = 'Chapter cache'
+
+    def __init__(self, path=CHAPTER_CACHE_PATH, max_bytes=CHAPTER_CACHE_MAX_MB * 1024 * 1024):
+        super().__init__(path, max_bytes, CHAPTER_CACHE_EVICT_TO)
+
+    def get(self, manga, chapter, file_format, fingerprint):
+        """
+        Returns a cached chapter file.
+
+        Parameters:
+            manga (str): The manga slug.
+            chapter (float): The chapter number.
+            file_format (str): The output format, e.g. 'pdf'.
+            fingerprint (str): The fingerprint of the chapter source.
+
+        Returns:
+            BytesIO: The file data, or None if the chapter is not cached.
+        """
+        try:
+            data = self._read(self._chapter_file(manga, chapter, file_format, fingerprint))
+        except OSError:
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return BytesIO(data)
+
+    def set(self, manga, chapter, file_format, fingerprint, data):
+        """
+        Stores a chapter file.
+
+        Parameters:
+            manga (str): The manga slug.
+            chapter (float): The chapter number.
+            file_format (str): The output format, e.g. 'pdf'.
+            fingerprint (str): The fingerprint of the chapter source.
+            data (bytes): The file data.
+        """
+        self._write(self._chapter_file(manga, chapter, file_format, fingerprint), data)
+
+    def _chapter_file(self, manga, chapter, file_format, fingerprint):
+        return self._file(json.dumps([manga, float(chapter), file_format, fingerprint]), file_format)
+
+
+chapter_cache = ChapterCache()
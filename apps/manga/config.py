@@ -2,6 +2,9 @@ from django.apps import AppConfig
 
 
 class MangaConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.manga'
     verbose_name = 'apps_manga'
+
+    def ready(self):
+        # Keep the search index in sync with catalogue edits
+        from apps.manga import signals  # noqa: F401
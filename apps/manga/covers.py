@@ -0,0 +1,102 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+# Constants
+COVERS_DIR = 'apps/static/assets/img/covers'
+THUMBNAIL_SIZE = (320, 480)
+THUMBNAIL_QUALITY = 85
+WEBP_QUALITY = 80
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def cover_path(file_name):
+    """
+    Returns the path of a cover file relative to the static assets folder, as stored in the database.
+
+    Parameters:
+        file_name (str): The name of the file inside COVERS_DIR.
+
+    Returns:
+        str: The relative path.
+    """
+    return os.path.join(COVERS_DIR, file_name).replace('apps/static/assets/', '')
+
+
+def write_once(file_name, write):
+    """
+    Writes a content-addressed file unless it already exists, through a temporary file so that readers never see a
+    partial file and concurrent writers of the same content do not clash.
+
+    Parameters:
+        file_name (str): The name of the file inside COVERS_DIR.
+        write (Callable[[file], None]): Writes the content into the given binary file.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    path = os.path.join(COVERS_DIR, file_name)
+    if os.path.exists(path):
+        return False
+    os.makedirs(COVERS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=COVERS_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+def store_cover(content):
+    """
+    Stores a downloaded cover under its content hash, with a resized JPEG thumbnail and a WebP variant of it.
+
+    Files that already exist are not written again, so covers shared by several mangas or unchanged since the last
+    crawl cost a hash and a few stat calls. Files are never modified once written, so they can be cached forever.
+
+    Parameters:
+        content (bytes): The downloaded image.
+
+    Returns:
+        dict: The content hash ('cover_hash') and the paths of the original image ('image_link'), the thumbnail
+            ('thumbnail_link') and its WebP variant ('thumbnail_webp_link'). The thumbnail paths are empty when the
+            image cannot be decoded.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    cover = {'cover_hash': digest, 'thumbnail_link': '', 'thumbnail_webp_link': ''}
+    try:
+        image = Image.open(io.BytesIO(content))
+        extension = EXTENSIONS.get(image.format, image.format.lower())
+    except (UnidentifiedImageError, OSError) as e:
+        logging.warning(f"Portada no reconocida ({digest}): {e}")
+        image, extension = None, 'img'
+
+    write_once(f'{digest}.{extension}', lambda f: f.write(content))
+    cover['image_link'] = cover_path(f'{digest}.{extension}')
+    if image is None:
+        return cover
+
+    thumbnail_name, webp_name = f'{digest}-thumb.jpg', f'{digest}-thumb.webp'
+    if not (os.path.exists(os.path.join(COVERS_DIR, thumbnail_name))
+            and os.path.exists(os.path.join(COVERS_DIR, webp_name))):
+        try:
+            # Para JPEG, draft decodifica directamente a una escala reducida, mucho más rápido que decodificar entera
+            image.draft('RGB', THUMBNAIL_SIZE)
+            thumbnail = image.convert('RGB')
+            thumbnail.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+        except OSError as e:
+            logging.warning(f"Portada no reconocida ({digest}): {e}")
+            return cover
+        write_once(thumbnail_name, lambda f: thumbnail.save(f, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True))
+        write_once(webp_name, lambda f: thumbnail.save(f, 'WEBP', quality=WEBP_QUALITY, method=4))
+
+    cover['thumbnail_link'] = cover_path(thumbnail_name)
+    cover['thumbnail_webp_link'] = cover_path(webp_name)
+    return cover
@@ -0,0 +1,110 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from apps.manga.http_client import http_client
+
+# Constants
+CRAWL_CONCURRENCY = 16
+CRAWL_PER_HOST = 8
+
+
+class Crawler:
+    """
+    Fetches URLs from asyncio code with at most `concurrency` requests in flight overall and `per_host` per host.
+
+    Requests go through an HttpClient, the shared one unless another one is given, run in a thread pool sized to the
+    global limit, so the event loop is never blocked while the client waits for the rate limiter, retries or
+    downloads.
+    """
+
+    def __init__(self, concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST, client=http_client):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        # Semaphores are created inside the running loop, as older Python versions bind them to the current loop
+        self._slots = None
+        self._host_slots = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Releases the thread pool. The client, and its pooled connections, are kept for the next crawl.
+        """
+        self._executor.shutdown(wait=True)
+
+    async def run(self, function, *args):
+        """
+        Runs a blocking function in the crawler's thread pool, e.g. to write a downloaded file.
+
+        Parameters:
+            function (Callable): The function to run.
+            *args: The arguments of the function.
+
+        Returns:
+            object: The value returned by the function.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args))
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """
+        Waits until a global and a per-host slot are free and holds them for the duration of a block.
+
+        Parameters:
+            url (str): The URL that will be downloaded inside the block.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        host = urlparse(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.per_host)
+
+        async with self._slots, self._host_slots[host]:
+            yield
+
+    async def get(self, url, headers=None):
+        """
+        Downloads a URL with the client in the crawler's thread pool, without waiting for a slot. Call it inside
+        slot(url).
+
+        Parameters:
+            url (str): The URL to download.
+            headers (dict, optional): Extra request headers, e.g. If-None-Match for a conditional request.
+
+        Returns:
+            requests.Response: The successful response, or a 304 one when a conditional request found no changes.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails or answers with an error status after its
+                retries, or the URL is not cached in replay mode.
+        """
+        response = await self.run(self.client.get, url, headers)
+        response.raise_for_status()
+        return response
+
+    async def fetch(self, url, headers=None):
+        """
+        Downloads a URL once a global and a per-host slot are free, unless it is in the response cache.
+
+        Parameters:
+            url (str): The URL to download.
+            headers (dict, optional): Extra request headers, e.g. If-None-Match for a conditional request.
+
+        Returns:
+            requests.Response: The successful response, or a 304 one when a conditional request found no changes.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails or answers with an error status after its
+                retries, or the URL is not cached in replay mode.
+        """
+        async with self.slot(url):
+            return await self.get(url, headers)
@@ -1,8 +1,14 @@
+import atexit
 import logging
 import os
+import threading
+from contextlib import contextmanager
 
-from whoosh.fields import Schema, TEXT, NUMERIC, KEYWORD
-from whoosh.index import create_in
+from whoosh.fields import Schema, TEXT, NUMERIC, KEYWORD, ID, NGRAMWORDS
+from whoosh.index import create_in, exists_in, open_dir
+from django.db import connections
+from whoosh.index import LockError
+from whoosh.writing import CLEAR
 
 from apps.manga.models import Manga
 
@@ -10,18 +16,59 @@ logging.basicConfig(level=logging.INFO)
 
 # Constants
 INDEX_PATH = "data/index"
+INDEX_DELAY = 2.0
+INDEX_BATCH_SIZE = 200
+WRITER_TIMEOUT = 10.0
+INDEX_CHUNK_SIZE = 2000
+# Each process may use up to INDEX_LIMIT_MB and writes its own segment, so more than one is opt-in
+INDEX_PROCS = int(os.getenv('INDEX_PROCS', 1))
+INDEX_LIMIT_MB = 256
+AUTOCOMPLETE_MIN_CHARS = 2
+AUTOCOMPLETE_MAX_CHARS = 20
 manga_schema = Schema(
+    manga_id=ID(stored=True, unique=True),
     title=TEXT(stored=True),
     author_name=TEXT(stored=True),
-    release_year=NUMERIC(stored=True),
+    # Sortable columns let the searcher order hits without loading them
+    # The column keeps the default as is, and a raw 0 reads back as the lowest 32-bit number, so the mangas without
+    # a release year sort after every real year instead of getting the highest one
+    release_year=NUMERIC(stored=True, sortable=True, default=0),
+    views=NUMERIC(sortable=True),
+    num_caps=NUMERIC(sortable=True),
     genres=KEYWORD(stored=True, commas=True),
+    # Prefixes of every word, for autocomplete
+    title_prefixes=NGRAMWORDS(minsize=AUTOCOMPLETE_MIN_CHARS, maxsize=AUTOCOMPLETE_MAX_CHARS, at='start'),
 )
 
 
+def schema_signature(schema):
+    """
+    Describe the fields of a schema by name, type, options and sortable column.
+
+    Whoosh fields with a sortable column do not compare equal to the same field read back from disk, so schemas are
+    compared by this signature instead.
+
+    Parameters:
+        schema (whoosh.fields.Schema): The schema.
+
+    Returns:
+        dict: A (field type, stored, unique, column type, column options) tuple for each field name.
+    """
+    return {
+        name: (type(field), field.stored, field.unique, type(field.column_type),
+               vars(field.column_type) if field.column_type else None)
+        for name, field in schema.items()
+    }
+
+
 def create_whoosh_index(index_path=INDEX_PATH):
     """
     Create or open a Whoosh index for manga.
 
+    An existing index is reopened when its schema has the same signature as manga_schema, so rebuilding it keeps
+    increasing the index generation and long-lived searchers can detect the change. Otherwise a new empty index is
+    created.
+
     Parameters:
         index_path (str, optional): The path to the directory where the index will be stored. Defaults to "data/index".
 
@@ -30,9 +77,36 @@ def create_whoosh_index(index_path=INDEX_PATH):
     """
     if not os.path.exists(index_path):
         os.makedirs(index_path)
+    if exists_in(index_path):
+        ix = open_dir(index_path)
+        if schema_signature(ix.schema) == schema_signature(manga_schema):
+            return ix
+        ix.close()
     return create_in(index_path, manga_schema)
 
 
+def manga_document(manga):
+    """
+    Build the Whoosh document fields for a manga.
+
+    Parameters:
+        manga (apps.manga.models.Manga): The Manga object to be indexed.
+
+    Returns:
+        dict: The field values, keyed by the names in manga_schema.
+    """
+    return {
+        'manga_id': str(manga.pk),
+        'title': manga.title,
+        'title_prefixes': manga.title,
+        'author_name': manga.author.name,
+        'release_year': manga.release_year,
+        'views': manga.views,
+        'num_caps': manga.num_caps,
+        'genres': ", ".join(genre.name for genre in manga.genres.all()),
+    }
+
+
 def index_manga(writer, manga):
     """
     Index manga information into the Whoosh index.
@@ -45,39 +119,182 @@ def index_manga(writer, manga):
         None
     """
     try:
-        writer.add_document(
-            title=manga.title,
-            author_name=manga.author.name,
-            release_year=manga.release_year,
-            genres=", ".join(genre.name for genre in manga.genres.all()),
-        )
-        logging.info(f"Indexed {manga.title}")
+        writer.add_document(**manga_document(manga))
+        logging.debug(f"Indexed {manga.title}")
     except Exception as e:
         logging.error(f"Error indexing {manga.title}: {e}")
 
 
-def index_all_mangas(index_path=INDEX_PATH):
+def iter_mangas(chunk_size=INDEX_CHUNK_SIZE):
+    """
+    Stream every manga with its author and genres, loading the catalogue in chunks of primary keys.
+
+    Each chunk costs one query for the mangas and their authors and one for their genres, and only one chunk is
+    kept in memory at a time (QuerySet.iterator ignores prefetch_related on this Django version).
+
+    Parameters:
+        chunk_size (int, optional): The number of mangas loaded per chunk. Defaults to INDEX_CHUNK_SIZE.
+
+    Yields:
+        apps.manga.models.Manga: The mangas in primary key order.
+    """
+    mangas = Manga.objects.select_related('author').prefetch_related('genres').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(mangas.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def index_all_mangas(index_path=INDEX_PATH, procs=INDEX_PROCS, limitmb=INDEX_LIMIT_MB, chunk_size=INDEX_CHUNK_SIZE):
     """
     Index all manga information from the database into the Whoosh index.
 
+    With more than one process the documents are indexed by Whoosh's multiprocessing writer, each process writing
+    its own segment, so the rebuild uses several cores while the memory of each writer stays under limitmb. Large
+    catalogues may benefit from it, at the cost of a multi-segment index and procs times the memory.
+
     Parameters:
         index_path (str, optional): The path to the directory where the index will be stored. Defaults to "data/index".
+        procs (int, optional): The number of indexing processes. Defaults to INDEX_PROCS (1).
+        limitmb (int, optional): The memory limit of each indexing process, in megabytes. Defaults to 256.
+        chunk_size (int, optional): The number of mangas loaded from the database at a time. Defaults to 2000.
 
     Returns:
         None
+
+    Raises:
+        whoosh.index.LockError: If the index stays locked for WRITER_TIMEOUT seconds.
     """
     ix = create_whoosh_index(index_path)
-    writer = ix.writer()
+    # Si el indexador incremental tiene el bloqueo, se espera a que termine su lote en vez de fallar
+    writer = ix.writer(procs=procs, limitmb=limitmb, multisegment=procs > 1, timeout=WRITER_TIMEOUT)
     try:
-        # Obtain all manga from the database
-        mangas = Manga.objects.all()
-
-        for manga in mangas:
+        indexed = 0
+        for manga in iter_mangas(chunk_size):
             index_manga(writer, manga)
+            indexed += 1
+            if indexed % chunk_size == 0:
+                logging.info(f"Indexed {indexed} mangas")
 
-        # Commit at the end of indexing
-        writer.commit()
-    except Exception as e:
-        logging.error(f"Error during indexing: {e}")
+        # Commit at the end of indexing, replacing every previous segment
+        writer.commit(mergetype=CLEAR)
+        logging.info(f"Indexed {indexed} mangas")
+    except Exception:
+        writer.cancel()
+        raise
     finally:
         ix.close()
+
+
+class IncrementalIndexer:
+    """
+    Keeps the Whoosh index in sync with single catalogue edits without rebuilding it.
+
+    Changes are queued by manga primary key and applied in batches from a background thread: the batch is flushed
+    INDEX_DELAY seconds after the first change, or right away once INDEX_BATCH_SIZE changes are pending. Updates use
+    update_document on the unique manga_id field and deletions remove that term, so each batch is a single commit.
+    """
+
+    def __init__(self, index_path=INDEX_PATH, delay=INDEX_DELAY, batch_size=INDEX_BATCH_SIZE):
+        self.index_path = index_path
+        self.delay = delay
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._suspended = 0
+
+    def schedule_update(self, manga_id):
+        """
+        Queue a manga to be (re)indexed.
+
+        Parameters:
+            manga_id (int): The primary key of the manga.
+        """
+        self._schedule(manga_id, 'update')
+
+    def schedule_delete(self, manga_id):
+        """
+        Queue a manga to be removed from the index.
+
+        Parameters:
+            manga_id (int): The primary key of the manga.
+        """
+        self._schedule(manga_id, 'delete')
+
+    @contextmanager
+    def suspended(self):
+        """
+        Ignore every change made inside the block, e.g. while the catalogue is reloaded before a full rebuild.
+        """
+        with self._lock:
+            self._suspended += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._suspended -= 1
+
+    def _schedule(self, manga_id, action):
+        with self._lock:
+            if self._suspended:
+                return
+            self._pending[manga_id] = action
+            if len(self._pending) >= self.batch_size:
+                self._start_flush(0)
+            elif self._timer is None:
+                self._start_flush(self.delay)
+
+    def _start_flush(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """
+        Apply every pending change to the index in a single commit.
+
+        If the index is locked by another writer (e.g. a full rebuild) the changes are queued again.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._timer = None
+        if not batch or not exists_in(self.index_path):
+            return
+        ix = open_dir(self.index_path)
+        try:
+            writer = ix.writer(timeout=WRITER_TIMEOUT)
+        except LockError:
+            ix.close()
+            logging.warning(f"Index locked, retrying {len(batch)} pending changes")
+            with self._lock:
+                for manga_id, action in batch.items():
+                    self._pending.setdefault(manga_id, action)
+                if self._timer is None:
+                    self._start_flush(self.delay)
+            return
+        try:
+            update_ids = [manga_id for manga_id, action in batch.items() if action == 'update']
+            mangas = Manga.objects.select_related('author').prefetch_related('genres').in_bulk(update_ids)
+            for manga_id in batch:
+                if manga_id in mangas:
+                    writer.update_document(**manga_document(mangas[manga_id]))
+                else:
+                    writer.delete_by_term('manga_id', str(manga_id))
+            writer.commit()
+            logging.info(f"Indexed {len(batch)} changed mangas")
+        except Exception as e:
+            writer.cancel()
+            logging.error(f"Error during incremental indexing: {e}")
+        finally:
+            ix.close()
+            connections.close_all()
+
+
+manga_indexer = IncrementalIndexer()
+atexit.register(manga_indexer.flush)
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+class DiskCache:
+    """
+    Base of the caches that keep their entries as files on disk, one file per key, sharded in subdirectories by the
+    first characters of the key digest.
+
+    Entries are written atomically, so concurrent readers never see a half-written file, and reading an entry marks
+    it as used through its access time. When the cache grows over `max_bytes`, the least recently used entries are
+    removed until it is back to `evict_to` of the budget. Subclasses choose the keys and the format of the entries.
+    """
+
+    name = 'Disk cache'
+
+    def __init__(self, path, max_bytes, evict_to):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            for file, _ in self._entries():
+                os.remove(file)
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache and its size on disk.
+
+        Returns:
+            dict: The counters, the hit rate and the size in bytes.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_size()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'bytes': self._size,
+            }
+
+    def _file(self, key, extension):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, digest[:2], f'{digest}.{extension}')
+
+    def _read(self, file):
+        with open(file, 'rb') as f:
+            data = f.read()
+        # La fecha de acceso marca el uso para el LRU, aunque el sistema de ficheros se monte con noatime. La de
+        # modificación se conserva, es la de escritura de la entrada
+        os.utime(file, (time.time(), os.path.getmtime(file)))
+        return data
+
+    def _write(self, file, data):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        old_size = os.path.getsize(file) if os.path.exists(file) else 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file)
+
+        with self._lock:
+            self._size = self._disk_size() if self._size is None else self._size + len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _entries(self):
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith('.tmp'):
+                    file = os.path.join(directory, name)
+                    yield file, os.stat(file)
+
+    def _disk_size(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_atime)
+        for file, stat in entries:
+            if self._size <= self.max_bytes * self.evict_to:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                continue
+            self._size -= stat.st_size
+            self.evictions += 1
+        logging.info(f"{self.name} evicted down to {self._size} bytes")
@@ -1,272 +1,308 @@
 import logging
-import os
-import re
-import sys
-import tempfile
-import time
 import zipfile
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Dict
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 import requests
-from bs4 import BeautifulSoup
+
 from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
-from selenium import webdriver
-from selenium.webdriver.common.by import By
+
+from apps.manga.browser import driver_pool, wait_for_element
+from apps.manga.chapter_cache import chapter_cache, chapter_fingerprint
+from apps.manga.extraction import parse_chapters, parse_page_count, parse_page_image, parse_title
+from apps.manga.http_client import http_client
 
 logging.basicConfig(level=logging.INFO)
 
+# Constants
+RESOLVE_WORKERS = 8
+PDF_FETCH_WORKERS = 8
+ZIP_CHUNK_SIZE = 64 * 1024
+
 
-def get_soup(url: str) -> BeautifulSoup:
+def get_html(url: str) -> str:
     """
-    Get the HTML content of a webpage and parse it into a BeautifulSoup object.
+    Get the HTML content of a webpage, through the shared HTTP client.
 
     Parameters:
         url (str): The URL of the webpage to retrieve.
 
     Returns:
-        BeautifulSoup: A BeautifulSoup object representing the parsed HTML content.
-    """
-    response = requests.get(url)
-    return BeautifulSoup(response.text, 'html.parser')
-
+        str: The HTML content of the webpage.
 
-def extract_title(soup: BeautifulSoup) -> str:
-    """
-    Extracts the title from a BeautifulSoup object.
-
-    Parameters:
-        soup (BeautifulSoup): The BeautifulSoup object containing the HTML.
-
-    Returns:
-        str: The extracted title.
+    Raises:
+        requests.exceptions.RequestException: If the page cannot be downloaded.
     """
-    return soup.find('div', class_='ttline').text.replace('Manga', '').strip()
+    response = http_client.get(url)
+    response.raise_for_status()
+    return response.text
 
 
-def extract_chapters(soup: BeautifulSoup) -> Dict[int, str]:
+def chapter_page_link(link: str, page: int) -> str:
     """
-    Extracts the chapters from a BeautifulSoup object.
+    Returns the link of a page of a chapter.
 
     Parameters:
-        soup (BeautifulSoup): The BeautifulSoup object representing the HTML.
+        link (str): The chapter link.
+        page (int): The page number, starting at 1.
 
     Returns:
-        dict: A dictionary mapping chapter numbers to chapter links.
+        str: The link of the reader page.
     """
-    sections = soup.find_all('ul', class_='sub_vol_ul')
-    chapter_elements = []
-    for section in sections:
-        chapter_elements.extend(section.find_all('li'))
-    chapter_links = {}
-    for chapter_element in chapter_elements:
-        link = chapter_element.find('a')['href']
-        print(chapter_element.find('a')['title'])
-        num_chapters = re.findall(r'\d+(?:\.\d+)?', chapter_element.find('a')['title'])
-        if len(num_chapters) >= 1:
-            num_chapter = max(num_chapters)
-        else:
-            posible_num_chapter = min(chapter_links.keys())
-            if posible_num_chapter <= 0:
-                num_chapter = posible_num_chapter - 1
-            else:
-                num_chapter = 0
-        chapter_number = float(num_chapter)
-        chapter_links[chapter_number] = link
-    return chapter_links
+    return link.replace('.html', '') + '-' + str(page) + '.html'
 
 
-def download_image(chapter_info: tuple, options: dict) -> str:
+def download_image(chapter_info: tuple) -> str:
     """
-    Downloads an image from a chapter link using the specified options.
+    Gets the image URL of a reader page with a browser from the pool, for pages that build it with JavaScript.
 
     Parameters:
         chapter_info (tuple): A tuple containing the chapter link, the key, and the index.
-        options (dict): A dictionary containing the options for the webdriver.
 
     Returns:
         str or None: The source of the downloaded image if successful, None otherwise.
     """
     chapter_link, key, i = chapter_info
-    driver = webdriver.Chrome(options=options)
     try:
-        driver.get(chapter_link)
-        time.sleep(5)
-        image = driver.find_element(By.CLASS_NAME, "manga_pic")
-        image_src = image.get_attribute('src')
-        return image_src
+        with driver_pool.driver() as driver:
+            driver.get(chapter_link)
+            return wait_for_element(driver, 'manga_pic', 'src').get_attribute('src')
     except Exception as e:
         logging.error(f"Error downloading image for chapter {key}-{i}: {e}")
         return None
-    finally:
-        driver.quit()
 
 
-def download_chapter_images(chapter_links: Dict[int, str]) -> list:
+def count_pages_with_browser(link: str) -> int:
     """
-    Downloads images for each chapter from a list of chapter links.
+    Reads the number of pages of a chapter with a browser from the pool.
 
     Parameters:
-        chapter_links (dict): A dictionary containing chapter names as keys and chapter links as values.
-        title (str): The title of the book.
-        options (dict): A dictionary containing options for downloading the images.
-        driver: The web driver instance used to navigate to the chapter links.
+        link (str): The chapter link.
 
     Returns:
-        list: A list of downloaded images for all chapters.
+        int: The number of pages.
     """
-    with ProcessPoolExecutor() as executor:
-        futures = []
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')  # Para ejecutar en segundo plano
-        driver = webdriver.Chrome(options=options)
-        for key, link in chapter_links.items():
-            driver.get(link)
-            last_chapter = driver.find_element(By.CLASS_NAME, "pic_download").text.split('/')[1]
-            for i in range(1, int(last_chapter) + 1):
-                chapter_link = link.replace('.html', '') + '-' + str(i) + '.html'
-                logging.info(f"Downloading image for chapter {key}-{i}")
-                future = executor.submit(download_image, (chapter_link, key, i), options)
-                futures.append(future)
-        images = [future.result() for future in futures if future.result() is not None]
-        driver.quit()
-        logging.info("Downloaded all images successfully")
-        return images
-
-
-def create_pdf(images: list) -> BytesIO:
+    with driver_pool.driver() as driver:
+        driver.get(link)
+        return int(wait_for_element(driver, 'pic_download').text.split('/')[1])
+
+
+def count_chapter_pages(link: str) -> int:
     """
-    Creates a PDF file from a list of image URLs.
+    Gets the number of pages of a chapter from its HTML, falling back to a browser if the HTML does not show it.
 
     Parameters:
-        images (list): A list of strings representing the URLs of the images to include in the PDF.
+        link (str): The chapter link.
 
     Returns:
-        BytesIO: A BytesIO object containing the generated PDF data.
-
-    Raises:
-        Exception: If there is an error creating the PDF or removing temporary files.
+        int: The number of pages.
     """
-    pdf_data = BytesIO()
-    c = canvas.Canvas(pdf_data, pagesize=letter)
-    width, height = letter
-    with ProcessPoolExecutor() as executor:
-        temp_files = []
-        try:
-            for image_url in images:
-                response = executor.submit(requests.get, image_url).result()
-                if response.status_code == 200:
-                    img_data = BytesIO(response.content)
-                    _, temp_file = tempfile.mkstemp(suffix=".png")
-                    temp_files.append(temp_file)
-                    with open(temp_file, 'wb') as temp_file_stream:
-                        temp_file_stream.write(img_data.getvalue())
-                    c.drawImage(temp_file, 0, 0, width, height)
-                    c.showPage()
-                    logging.info(f"Added image to PDF: {image_url}")
-                else:
-                    logging.error(f"Failed to download image: {image_url}")
-        except Exception as e:
-            logging.error(f"Error creating PDF: {e}")
-        finally:
-            for temp_file in temp_files:
-                try:
-                    os.remove(temp_file)
-                except Exception as e:
-                    logging.error(f"Error removing temporary file {temp_file}: {e}")
+    try:
+        count = parse_page_count(get_html(link))
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Error downloading {link}: {e}")
+        count = None
+    if count is None:
+        logging.info(f"Page count of {link} not found in its HTML, using the browser")
+        count = count_pages_with_browser(link)
+    return count
 
-    c.save()
-    logging.info('PDF generated')
-    pdf_data.seek(0)
 
-    return pdf_data
+def resolve_page_image(page_info: tuple) -> Optional[str]:
+    """
+    Gets the image URL of a reader page from its HTML, falling back to a browser if the HTML does not contain it.
 
+    Parameters:
+        page_info (tuple): A tuple containing the reader page link, the chapter key, and the page number.
 
+    Returns:
+        str or None: The image URL, or None if it could not be found.
+    """
+    page_link, key, i = page_info
+    try:
+        image_src = parse_page_image(get_html(page_link))
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Error downloading {page_link}: {e}")
+        image_src = None
+    if image_src is None:
+        logging.info(f"Image of chapter {key}-{i} not found in its HTML, using the browser")
+        image_src = download_image(page_info)
+    return image_src
 
 
-def download_selected_chapters(manga: str, chapters: list) -> dict:
+def download_chapter_images(chapter_links: Dict[int, str], page_counts: Optional[Dict[int, int]] = None) -> list:
     """
-    Downloads the selected chapters of a manga.
+    Resolves the image URLs of every page of the given chapters, in chapter and page order.
+
+    Reader pages are read over HTTP, RESOLVE_WORKERS at a time, and only the ones whose HTML does not contain the image
+    are opened in a browser.
 
     Parameters:
-        manga (str): The name of the manga.
-        chapters (list): A list of chapter numbers to download.
+        chapter_links (dict): A dictionary containing chapter names as keys and chapter links as values.
+        page_counts (dict, optional): The number of pages of the chapters, when they are already known.
 
     Returns:
-        dict: A dictionary mapping PDF filenames to BytesIO objects containing the PDF data.
+        list: A list of the image URLs of all chapters.
     """
-    url = f'https://my.ninemanga.com/manga/{manga}.html?waring=1'
-    try:
-        soup = get_soup(url)
-        manga_title = extract_title(soup)
-        chapter_links = extract_chapters(soup)
-        dic_chapter = {}
-        for chapter_number, link in chapter_links.items():
-            if int(chapter_number) in chapters:
-                chapter_images = download_chapter_images({chapter_number: link})
-                pdf_filename = f'{manga_title} Chapter {chapter_number}.pdf'
-                dic_chapter[pdf_filename] = create_pdf(chapter_images)
-        return dic_chapter
-    except Exception as e:
-        logging.error(f"Error downloading chapters: {e}")
+    pages = []
+    for key, link in chapter_links.items():
+        count = page_counts[key] if page_counts else count_chapter_pages(link)
+        pages.extend((chapter_page_link(link, i), key, i) for i in range(1, count + 1))
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as executor:
+        images = [image for image in executor.map(resolve_page_image, pages) if image is not None]
+    logging.info(f"Resolved {len(images)} of {len(pages)} images")
+    return images
 
 
-def download_range_of_chapters(manga: str, start_chapter: int, end_chapter: int) -> dict:
+def fetch_page_image(image_url: str) -> Optional[bytes]:
     """
-    Download all chapters of a manga.
+    Downloads the image of a page.
 
     Parameters:
-        manga (str): The name of the manga to download.
+        image_url (str): The image URL.
 
     Returns:
-        dict: A dictionary mapping PDF filenames to BytesIO objects containing the PDF data.
+        bytes or None: The image data, or None if it could not be downloaded.
     """
-    return download_selected_chapters(manga, range(start_chapter, end_chapter + 1))
+    try:
+        response = http_client.get(image_url)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to download image: {image_url}: {e}")
+        return None
+    if response.status_code != 200:
+        logging.error(f"Failed to download image: {image_url}")
+        return None
+    return response.content
 
 
-def download_all_chapters(manga: str) -> dict:
+def create_pdf(images: list) -> Tuple[BytesIO, int]:
     """
-    Download all chapters of a manga.
+    Creates a PDF file from a list of image URLs.
+
+    The images are downloaded PDF_FETCH_WORKERS at a time and drawn from memory in the order of the list. Images that
+    cannot be downloaded or read are left out.
 
     Parameters:
-        manga (str): The name of the manga to download chapters from.
+        images (list): A list of strings representing the URLs of the images to include in the PDF.
 
     Returns:
-        dict: A dictionary mapping PDF filenames to BytesIO objects containing the PDF data.
+        tuple: A BytesIO object containing the generated PDF data and the number of images drawn.
     """
-    return download_selected_chapters(manga, range(-sys.maxsize, sys.maxsize))
+    pdf_data = BytesIO()
+    c = canvas.Canvas(pdf_data, pagesize=letter)
+    width, height = letter
+    with ThreadPoolExecutor(max_workers=PDF_FETCH_WORKERS) as executor:
+        # map devuelve las imágenes en el orden de las páginas, cada una en cuanto ella y las anteriores han llegado
+        for image_url, content in zip(images, executor.map(fetch_page_image, images)):
+            if content is None:
+                continue
+            try:
+                c.drawImage(ImageReader(BytesIO(content)), 0, 0, width, height)
+            except Exception as e:
+                logging.error(f"Error adding image to PDF: {image_url}: {e}")
+                continue
+            c.showPage()
+            logging.info(f"Added image to PDF: {image_url}")
+
+    pages = c.getPageNumber() - 1
+    c.save()
+    logging.info('PDF generated')
+    pdf_data.seek(0)
 
+    return pdf_data, pages
 
-def create_zip(pdf_data_dic: dict) -> BytesIO:
+
+def iter_selected_chapters(manga: str, chapters) -> Iterator[Tuple[str, BytesIO]]:
     """
-    Crea un archivo ZIP que contiene varios archivos PDF.
+    Downloads the selected chapters of a manga one by one, yielding each PDF as soon as it is ready. Chapters that
+    were rendered before are read from the chapter cache.
 
     Parameters:
-        pdf_data_dic (dict): Un diccionario donde las claves son títulos y los valores son datos de archivos PDF (BytesIO).
+        manga (str): The name of the manga.
+        chapters (Iterable[int]): The chapter numbers to download.
 
-    Returns:
-        BytesIO: Un BytesIO que contiene los datos del archivo ZIP.
+    Yields:
+        tuple: The PDF filename and a BytesIO object containing the PDF data.
     """
-    try:
-        # Crear un BytesIO para almacenar el archivo ZIP
-        zip_buffer = BytesIO()
+    url = f'https://my.ninemanga.com/manga/{manga}.html?waring=1'
+    html = get_html(url)
+    manga_title = parse_title(html)
+    chapter_links = parse_chapters(html)
+    for chapter_number, link in chapter_links.items():
+        if int(chapter_number) in chapters:
+            pdf_filename = f'{manga_title} Chapter {chapter_number}.pdf'
+            # La clave sale de la página del manga, así un capítulo en caché no abre sus páginas de lectura
+            fingerprint = chapter_fingerprint(link)
+            pdf_data = chapter_cache.get(manga, chapter_number, 'pdf', fingerprint)
+            if pdf_data is None:
+                pages = count_chapter_pages(link)
+                chapter_images = download_chapter_images({chapter_number: link}, {chapter_number: pages})
+                pdf_data, drawn = create_pdf(chapter_images)
+                # Un capítulo al que le faltan páginas no se guarda, para volver a intentarlo en la próxima descarga
+                if drawn == pages:
+                    chapter_cache.set(manga, chapter_number, 'pdf', fingerprint, pdf_data.getvalue())
+            else:
+                logging.info(f"Chapter {chapter_number} of {manga} served from the chapter cache")
+            yield pdf_filename, pdf_data
 
-        # Crear un objeto ZipFile en modo escritura
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Agregar cada PDF al archivo ZIP
-            for title, pdf_data in pdf_data_dic.items():
-                # Agregar el PDF al archivo ZIP con el nombre del título
-                zip_file.writestr(title, pdf_data.getvalue())
 
-        # Mover el puntero del BytesIO al principio
-        zip_buffer.seek(0)
+class ZipStream:
+    """
+    A write-only file that zipfile writes the archive to, handing over what has been written since the last call to
+    pop, so the archive can be sent while it is built.
+    """
 
-        return zip_buffer
-    except Exception as e:
-        # Manejar cualquier error que pueda ocurrir durante la creación del archivo ZIP
-        print(f"Error al crear el archivo ZIP: {e}")
-        return None
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        """
+        Returns the bytes written since the last call and forgets them.
 
+        Returns:
+            bytes: The written bytes.
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
 
+
+def stream_zip(pdf_files: Iterable[Tuple[str, BytesIO]]) -> Iterator[bytes]:
+    """
+    Genera un archivo ZIP con varios archivos PDF a medida que llegan, por trozos de como mucho ZIP_CHUNK_SIZE bytes
+    sin comprimir, sin guardarlo entero en memoria ni en disco.
+
+    Si falla la descarga de un PDF, el error se propaga sin cerrar el ZIP: la respuesta ya ha empezado, así que la
+    transferencia se corta y el cliente recibe un archivo incompleto en lugar de un ZIP válido al que le faltan
+    capítulos.
+
+    Parameters:
+        pdf_files (Iterable[tuple]): Pares de título y datos del archivo PDF (BytesIO).
+
+    Yields:
+        bytes: El siguiente trozo del archivo ZIP.
+    """
+    stream = ZipStream()
+    # Como el destino no admite seek, zipfile escribe el tamaño de cada archivo detrás de sus datos
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        try:
+            for title, pdf_data in pdf_files:
+                with zip_file.open(title, 'w') as entry:
+                    for block in iter(lambda: pdf_data.read(ZIP_CHUNK_SIZE), b''):
+                        entry.write(block)
+                        yield stream.pop()
+                yield stream.pop()
+        except Exception as e:
+            logging.error(f"Error al crear el archivo ZIP: {e}")
+            raise
+    yield stream.pop()
@@ -0,0 +1,163 @@
+import re
+from typing import Dict, Optional
+
+from lxml import etree, html as lxml_html
+
+
+def has_class(name: str) -> str:
+    """
+    Builds the XPath condition of an element having a CSS class, like BeautifulSoup's class_ argument.
+
+    Parameters:
+        name (str): The class name.
+
+    Returns:
+        str: The XPath condition.
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Las expresiones se compilan una sola vez, no en cada página
+CATEGORY_MANGAS = etree.XPath(f"(//ul[{has_class('direlist')}])[1]//dl[{has_class('bookinfo')}]")
+BOOKNAME = etree.XPath(f"(.//a[{has_class('bookname')}])[1]")
+FIRST_IMAGE_SRC = etree.XPath("(.//img)[1]/@src")
+FIRST_SPAN = etree.XPath("(.//span)[1]")
+AUTHOR = etree.XPath("(//b[. = 'Autor(s):'])[1]/following::a[1]")
+RELEASE_YEAR = etree.XPath("(//b[. = 'Año'])[1]/following::a[1]")
+GENRES = etree.XPath("(//li[@itemprop = 'genre'])[1]//a")
+CHAPTER_LINKS = etree.XPath(f"//ul[{has_class('sub_vol_ul')}]//a")
+CHAPTER_ITEMS = etree.XPath(f"//ul[{has_class('sub_vol_ul')}]//li")
+FIRST_LINK = etree.XPath("(.//a)[1]")
+TITLE = etree.XPath(f"(//div[{has_class('ttline')}])[1]")
+PAGE_COUNTER = etree.XPath(f"(//*[{has_class('pic_download')}])[1]")
+PAGE_IMAGE_SRC = etree.XPath(f"(//*[{has_class('manga_pic')}])[1]/@src")
+
+
+def parse_html(html):
+    """
+    Parses a page with lxml, which is several times faster than building a BeautifulSoup tree.
+
+    Parameters:
+        html (str or bytes): The HTML of the page.
+
+    Returns:
+        lxml.html.HtmlElement: The root of the page.
+    """
+    return lxml_html.document_fromstring(html)
+
+
+def parse_category_page(html) -> list:
+    """
+    Extracts the mangas listed in a category page.
+
+    Parameters:
+        html (str or bytes): The HTML of the category page.
+
+    Returns:
+        List[dict]: The title, details link, cover URL and views of each listed manga.
+    """
+    entries = []
+    for manga in CATEGORY_MANGAS(parse_html(html)):
+        bookname = BOOKNAME(manga)[0]
+        entries.append({
+            'title': bookname.text_content(),
+            'details_link': bookname.get('href'),
+            'image_url': FIRST_IMAGE_SRC(manga)[0],
+            'views': int(FIRST_SPAN(manga)[0].text_content().replace('views', '').replace(',', '').strip()),
+        })
+    return entries
+
+
+def parse_details_page(html) -> dict:
+    """
+    Extracts the author, release year, genres and number of chapters from a manga details page.
+
+    Parameters:
+        html (str or bytes): The HTML of the details page.
+
+    Returns:
+        dict: The author name and release year (None when missing), the genre names and the number of chapters.
+    """
+    root = parse_html(html)
+    author = AUTHOR(root)
+    release_year = RELEASE_YEAR(root)
+    return {
+        'author_name': author[0].text_content().strip() if author else None,
+        'release_year': int(release_year[0].text_content()) if release_year else None,
+        'genre_names': [genre.text_content() for genre in GENRES(root)],
+        'num_caps': len(CHAPTER_LINKS(root)),
+    }
+
+
+def parse_title(html) -> str:
+    """
+    Extracts the title from a manga details page.
+
+    Parameters:
+        html (str or bytes): The HTML of the details page.
+
+    Returns:
+        str: The extracted title.
+    """
+    return TITLE(parse_html(html))[0].text_content().replace('Manga', '').strip()
+
+
+def parse_chapters(html) -> Dict[float, str]:
+    """
+    Extracts the chapters from a manga details page.
+
+    Parameters:
+        html (str or bytes): The HTML of the details page.
+
+    Returns:
+        dict: A dictionary mapping chapter numbers to chapter links.
+    """
+    chapter_links = {}
+    for chapter_element in CHAPTER_ITEMS(parse_html(html)):
+        link = FIRST_LINK(chapter_element)[0]
+        num_chapters = re.findall(r'\d+(?:\.\d+)?', link.get('title'))
+        if len(num_chapters) >= 1:
+            num_chapter = max(num_chapters)
+        else:
+            posible_num_chapter = min(chapter_links.keys())
+            if posible_num_chapter <= 0:
+                num_chapter = posible_num_chapter - 1
+            else:
+                num_chapter = 0
+        chapter_links[float(num_chapter)] = link.get('href')
+    return chapter_links
+
+
+def parse_page_count(html) -> Optional[int]:
+    """
+    Extracts the number of pages of a chapter from one of its reader pages, shown as 'current/total'.
+
+    Parameters:
+        html (str or bytes): The HTML of the reader page.
+
+    Returns:
+        int or None: The number of pages, or None if the page does not show it, e.g. because it is rendered by
+            JavaScript.
+    """
+    counter = PAGE_COUNTER(parse_html(html))
+    if not counter:
+        return None
+    try:
+        return int(counter[0].text_content().split('/')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_page_image(html) -> Optional[str]:
+    """
+    Extracts the URL of the image of a reader page.
+
+    Parameters:
+        html (str or bytes): The HTML of the reader page.
+
+    Returns:
+        str or None: The image URL, or None if the page does not contain it, e.g. because it is rendered by
+            JavaScript.
+    """
+    src = PAGE_IMAGE_SRC(parse_html(html))
+    return src[0] if src and src[0].strip() else None
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from apps.manga.disk_cache import DiskCache
+
+# Constants
+HTTP_CACHE_PATH = os.getenv('HTTP_CACHE_PATH', 'data/http_cache')
+HTTP_CACHE_MODE = os.getenv('HTTP_CACHE_MODE', 'cache')
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', 3600))
+HTTP_CACHE_MAX_MB = int(os.getenv('HTTP_CACHE_MAX_MB', 512))
+HTTP_CACHE_EVICT_TO = 0.9
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+OFF, CACHE, REPLAY = 'off', 'cache', 'replay'
+
+
+class CacheMissError(requests.exceptions.ConnectionError):
+    """
+    Raised in replay mode for a URL that is not in the cache, as if the network were down.
+    """
+
+
+class ResponseCache(DiskCache):
+    """
+    Stores successful responses on disk, gzip-compressed and keyed by URL, so repeated crawls do not download the
+    same pages again.
+
+    Entries older than `ttl` seconds are downloaded again. When the cache grows over `max_bytes`, the least recently
+    used entries are removed until it is back to HTTP_CACHE_EVICT_TO of the budget. The mode is one of:
+
+    - 'cache': serve fresh entries and store new responses.
+    - 'replay': serve every entry, however old, and raise CacheMissError for anything else, so crawls and parsing
+      experiments can be re-run without network.
+    - 'off': always download.
+    """
+
+    name = 'Response cache'
+
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_MB * 1024 * 1024,
+                 mode=HTTP_CACHE_MODE):
+        super().__init__(path, max_bytes, HTTP_CACHE_EVICT_TO)
+        self.ttl = ttl
+        self.mode = mode
+
+    def get(self, url):
+        """
+        Returns the cached response of a URL.
+
+        Parameters:
+            url (str): The URL.
+
+        Returns:
+            requests.Response: The cached response, or None if the URL is not cached or its entry expired.
+
+        Raises:
+            CacheMissError: In replay mode, if the URL is not cached.
+        """
+        if self.mode == OFF:
+            return None
+        file = self._file(url, 'gz')
+        try:
+            # La fecha de modificación es la de descarga, para el TTL
+            age = time.time() - os.path.getmtime(file)
+            data = gzip.decompress(self._read(file)) if self.mode == REPLAY or age <= self.ttl else None
+        except (OSError, EOFError):
+            data = None
+
+        self._count(hit=data is not None)
+        if data is None:
+            if self.mode == REPLAY:
+                raise CacheMissError(f"{url} is not in the response cache")
+            return None
+        header, content = data.split(b'\n', 1)
+        return build_response(json.loads(header), content)
+
+    def set(self, url, response):
+        """
+        Stores a successful response. Other responses, and every response in replay and off modes, are ignored.
+
+        Parameters:
+            url (str): The URL the response was requested with.
+            response (requests.Response): The response.
+        """
+        if self.mode != CACHE or response.status_code != 200:
+            return
+        meta = {
+            'url': url,
+            'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            'encoding': response.encoding,
+        }
+        # Las imágenes ya vienen comprimidas, no merece la pena volver a comprimirlas
+        level = 0 if response.headers.get('Content-Type', '').startswith('image/') else 6
+        data = gzip.compress(json.dumps(meta).encode() + b'\n' + response.content, level)
+
+        self._write(self._file(url, 'gz'), data)
+
+    def stats(self):
+        """
+        Returns the mode of the cache, its hit and miss counters and its size on disk.
+
+        Returns:
+            dict: The mode, the counters, the hit rate and the size in bytes.
+        """
+        return {'mode': self.mode, **super().stats()}
+
+
+def build_response(meta, content):
+    """
+    Rebuilds a requests.Response from a cache entry, which callers can use as a downloaded one. Its from_cache
+    attribute is set, e.g. to count cache hits.
+
+    Parameters:
+        meta (dict): The URL, kept headers and encoding of the response.
+        content (bytes): The body of the response.
+
+    Returns:
+        requests.Response: The response.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response.url = meta['url']
+    response.headers = CaseInsensitiveDict(meta['headers'])
+    response.encoding = meta['encoding']
+    response._content = content
+    response.from_cache = True
+    return response
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,168 @@
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from apps.manga.http_cache import response_cache
+
+# Constants
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 4))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+HTTP_BACKOFF_MAX = 30.0
+HTTP_RATE_PER_HOST = float(os.getenv('HTTP_RATE_PER_HOST', 8))
+HTTP_BURST_PER_HOST = int(os.getenv('HTTP_BURST_PER_HOST', 16))
+HTTP_POOL_SIZE = 32
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Lets through at most `rate` calls per second on average, with bursts of up to `capacity` calls.
+
+    Thread-safe: acquire blocks the calling thread until a token is available.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting for one if the bucket is empty.
+
+        Returns:
+            float: The seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # El token se reserva ya, aunque haya que esperar a que se genere, para que los hilos hagan cola en orden
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HttpClient:
+    """
+    The HTTP client shared by all the scraping code.
+
+    Requests go through the response cache first. Downloads use one pooled requests.Session with connect and read
+    timeouts, are limited per host by a token bucket, and are retried with exponential backoff and jitter on
+    connection errors, timeouts and 429/5xx answers, honouring Retry-After when the server sends it.
+    """
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), retries=HTTP_RETRIES, backoff=HTTP_BACKOFF,
+                 rate=HTTP_RATE_PER_HOST, burst=HTTP_BURST_PER_HOST, pool_size=HTTP_POOL_SIZE, cache=response_cache):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.burst = burst
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+        self.retried = 0
+        self.throttled_seconds = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        """
+        Downloads a URL, unless it is in the response cache.
+
+        Parameters:
+            url (str): The URL.
+            headers (dict, optional): Extra request headers, e.g. If-None-Match for a conditional request.
+
+        Returns:
+            requests.Response: The response of the last attempt, which may still have an error status.
+
+        Raises:
+            requests.exceptions.RequestException: If the last attempt fails to connect or times out, or the URL is not
+                cached in replay mode.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached is not None:
+                return cached
+
+        bucket = self._bucket(urlparse(url).netloc)
+        for attempt in range(self.retries + 1):
+            throttled = bucket.acquire()
+            with self._lock:
+                self.throttled_seconds += throttled
+                self.requests += 1
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"{url}: {e}, retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    break
+                delay = self._retry_after(response) or self._backoff(attempt)
+                logging.warning(f"{url}: {response.status_code}, retrying in {delay:.1f}s")
+            with self._lock:
+                self.retried += 1
+            time.sleep(delay)
+
+        if self.cache is not None:
+            self.cache.set(url, response)
+        return response
+
+    def stats(self):
+        """
+        Returns the request counters of the client.
+
+        Returns:
+            dict: The requests sent, the retries and the seconds spent waiting for the rate limiter.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retried,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+            }
+
+    def close(self):
+        """
+        Releases the pooled connections.
+        """
+        self.session.close()
+
+    def _bucket(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def _backoff(self, attempt):
+        # Espera exponencial con jitter completo, para que los hilos no reintenten todos a la vez
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, self.backoff * 2 ** attempt))
+
+    def _retry_after(self, response):
+        try:
+            return min(HTTP_BACKOFF_MAX, float(response.headers['Retry-After']))
+        except (KeyError, ValueError):
+            return None
+
+
+http_client = HttpClient()
@@ -0,0 +1,83 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from apps.manga.http_client import http_client
+
+# Constants
+STAGES = ['fetch', 'parse', 'covers', 'db']
+
+
+class ImportStats:
+    """
+    Thread-safe timers and counters of the stages of an import: fetching pages and covers, parsing pages, storing
+    covers and saving rows.
+
+    Each stage counts its items, the seconds spent on them and its errors, plus extra counters such as downloaded
+    bytes. Stages run concurrently, so their seconds are summed over items and can add up to more than the run.
+    """
+
+    def __init__(self, client=http_client):
+        self.client = client
+        self.started = time.perf_counter()
+        self.stages = {stage: {'count': 0, 'seconds': 0.0, 'errors': 0} for stage in STAGES}
+        self._client_start = client.stats() if client else {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage, count=1):
+        """
+        Times a block as `count` items of a stage, counting an error if it raises.
+
+        Parameters:
+            stage (str): The stage.
+            count (int, optional): The number of items processed by the block. Defaults to 1.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.add(stage, errors=1)
+            raise
+        self.add(stage, count=count, seconds=time.perf_counter() - start)
+
+    def add(self, stage, **counters):
+        """
+        Adds to the counters of a stage, creating the ones it does not have yet.
+
+        Parameters:
+            stage (str): The stage.
+            **counters: The amounts to add, e.g. bytes=1024.
+        """
+        with self._lock:
+            values = self.stages[stage]
+            for name, amount in counters.items():
+                values[name] = values.get(name, 0) + amount
+
+    def summary(self):
+        """
+        Returns the counters of every stage, with their average milliseconds per item, and the database throughput.
+
+        Returns:
+            dict: The seconds since the import started, the stages and the rows written per second in every table
+                (authors, genres, mangas and their genre links), which is more than the mangas per second.
+        """
+        with self._lock:
+            stages = {stage: dict(values) for stage, values in self.stages.items()}
+        for values in stages.values():
+            values['ms_per_item'] = round(1000 * values['seconds'] / values['count'], 2) if values['count'] else None
+            values['seconds'] = round(values['seconds'], 3)
+            if 'queue_seconds' in values:
+                values['queue_seconds'] = round(values['queue_seconds'], 3)
+        if self.client:
+            client = self.client.stats()
+            stages['fetch']['retries'] = client['retries'] - self._client_start['retries']
+            stages['fetch']['throttled_seconds'] = round(
+                client['throttled_seconds'] - self._client_start['throttled_seconds'], 3
+            )
+        db = stages['db']
+        return {
+            'seconds': round(time.perf_counter() - self.started, 3),
+            'stages': stages,
+            'rows_per_second': round(db.get('rows', 0) / db['seconds'], 1) if db['seconds'] else None,
+        }
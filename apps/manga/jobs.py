@@ -0,0 +1,174 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.manga.create_index import index_all_mangas, manga_indexer
+from apps.manga.import_stats import ImportStats
+from apps.manga.models import PopulateJob
+from apps.manga.populate_db import BASE_URL, MAX_PAGES, populate_mangas
+
+# Constants
+JOB_BATCH_SIZE = 100
+STALE_AFTER = timedelta(minutes=10)
+HEARTBEAT_EVERY = timedelta(minutes=1)
+MAX_ATTEMPTS = 3
+JOB_ERROR_LENGTH = 200
+
+
+def enqueue_populate(base_url=BASE_URL, max_pages=MAX_PAGES, delta=False):
+    """
+    Queues a populate job for the worker, unless one is already pending or running.
+
+    Parameters:
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        max_pages (int, optional): The number of category pages to crawl. Defaults to MAX_PAGES.
+        delta (bool, optional): Whether to update the stored mangas instead of replacing them. Defaults to False.
+
+    Returns:
+        PopulateJob: The queued job, or the active one.
+    """
+    active = PopulateJob.objects.filter(status__in=[PopulateJob.PENDING, PopulateJob.RUNNING]).first()
+    if active:
+        return active
+    return PopulateJob.objects.create(base_url=base_url, max_pages=max_pages, delta=delta)
+
+
+def claim_job():
+    """
+    Takes the oldest pending job, or a running one whose worker stopped sending checkpoints, e.g. after a crash.
+
+    The claim is a conditional UPDATE, so two workers never take the same job. Jobs abandoned MAX_ATTEMPTS times are
+    marked as failed instead.
+
+    Returns:
+        PopulateJob: The claimed job, or None if there is nothing to do.
+    """
+    stale = timezone.now() - STALE_AFTER
+    candidates = PopulateJob.objects.filter(
+        Q(status=PopulateJob.PENDING) | Q(status=PopulateJob.RUNNING, updated_at__lt=stale)
+    )
+    for job in candidates:
+        if job.attempts >= MAX_ATTEMPTS:
+            PopulateJob.objects.filter(pk=job.pk, updated_at=job.updated_at).update(
+                status=PopulateJob.FAILED, error=f"Abandoned after {job.attempts} attempts", finished_at=timezone.now()
+            )
+            continue
+        claimed = PopulateJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status=PopulateJob.RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def touch_job(job):
+    """
+    Marks a job as alive, without saving any other field.
+
+    Parameters:
+        job (PopulateJob): The running job.
+    """
+    PopulateJob.objects.filter(pk=job.pk).update(updated_at=timezone.now())
+
+
+@contextmanager
+def heartbeat(job, every):
+    """
+    Marks a job as alive every `every` while a block without checkpoints runs, e.g. the index rebuild, so claim_job
+    does not take it as abandoned after STALE_AFTER.
+
+    Parameters:
+        job (PopulateJob): The running job.
+        every (timedelta): The time between two marks.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(every.total_seconds()):
+                touch_job(job)
+        finally:
+            # El hilo abre su propia conexión a la base de datos
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """
+    Crawls the pages of a job, saving its mangas in transactions of JOB_BATCH_SIZE records each together with a
+    checkpoint, then rebuilds the search index.
+
+    A job that is run again, e.g. after a crash, resumes after the last page of its last saved batch, and its mangas
+    are matched by details link so none is saved twice. If the index cannot be rebuilt the job fails, so it is never
+    reported as done with a stale index. The rebuild saves no checkpoints, so a heartbeat keeps the job from being
+    claimed again while it runs.
+
+    Parameters:
+        job (PopulateJob): The claimed job.
+    """
+    logging.info(f"Populate job {job.pk}: pages {job.next_page}-{job.max_pages}")
+    try:
+        stats = ImportStats()
+
+        def checkpoint(page, crawled):
+            job.next_page = page + 1
+            job.mangas_crawled += crawled
+            job.stats = stats.summary()
+            job.save(update_fields=['next_page', 'mangas_crawled', 'stats', 'updated_at'])
+
+        # El índice se reconstruye entero al final, no hace falta indexar cada cambio
+        with manga_indexer.suspended():
+            job.stats = populate_mangas(job.base_url, job.max_pages, job.delta, JOB_BATCH_SIZE, job.next_page,
+                                        checkpoint, stats)
+        # La reconstrucción no guarda checkpoints, y en catálogos grandes puede durar más que STALE_AFTER
+        touch_job(job)
+        with heartbeat(job, HEARTBEAT_EVERY):
+            index_all_mangas()
+    except Exception as e:
+        # La traza completa solo va al log, el estado del trabajo es público
+        logging.exception(f"Populate job {job.pk} failed")
+        job.status = PopulateJob.FAILED
+        job.error = f"{type(e).__name__}: {e}"[:JOB_ERROR_LENGTH]
+    else:
+        job.status = PopulateJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'stats', 'finished_at', 'updated_at'])
+
+
+def job_status(job):
+    """
+    Describes the progress of a job.
+
+    Parameters:
+        job (PopulateJob): The job.
+
+    Returns:
+        dict: The status, progress, import stats (as of the last checkpoint) and timestamps of the job.
+    """
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'delta': job.delta,
+        'pages_done': job.pages_done,
+        'max_pages': job.max_pages,
+        'mangas_crawled': job.mangas_crawled,
+        'attempts': job.attempts,
+        'error': job.error,
+        'stats': job.stats,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.manga.benchmark import EXTRACTION_REPEAT, benchmark_extraction, load_saved_pages
+
+
+class Command(BaseCommand):
+    help = ('Compares the BeautifulSoup and lxml extraction of category, details and chapter pages over saved pages, '
+            'by default the HTML pages in the response cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='HTML files or folders (default: the response cache)')
+        parser.add_argument('--repeat', type=int, default=EXTRACTION_REPEAT,
+                            help=f'Extractions per page (default: {EXTRACTION_REPEAT})')
+        parser.add_argument('--output', help='Write the results to this JSON file instead of the standard output')
+
+    def handle(self, *args, **options):
+        pages = load_saved_pages(options['paths'])
+        if not pages:
+            raise CommandError('No saved pages found')
+        report = json.dumps({'results': benchmark_extraction(pages, options['repeat'])}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.manga.benchmark import BROWSER_PAGES, EXTRACTION_REPEAT, benchmark_page_resolution, load_saved_pages
+
+
+class Command(BaseCommand):
+    help = ('Measures the pages per second of resolving chapter images from saved reader pages, by default the HTML '
+            'pages in the response cache, optionally against the headless browser.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='HTML files or folders (default: the response cache)')
+        parser.add_argument('--repeat', type=int, default=EXTRACTION_REPEAT,
+                            help=f'Resolutions per page (default: {EXTRACTION_REPEAT})')
+        parser.add_argument('--browser', action='store_true',
+                            help=f'Also resolve {BROWSER_PAGES} pages with the headless browser (needs Chrome)')
+        parser.add_argument('--output', help='Write the results to this JSON file instead of the standard output')
+
+    def handle(self, *args, **options):
+        pages = load_saved_pages(options['paths'])
+        results = benchmark_page_resolution(pages, options['repeat'], BROWSER_PAGES if options['browser'] else 0)
+        if not results:
+            raise CommandError('No saved reader pages found')
+        report = json.dumps({'results': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.manga.benchmark import REQUESTS_PER_SCENARIO, benchmark_scale, parse_scale
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks index building and the listing and autocomplete views over synthetic catalogues. '
+            'Runs against a throwaway test database, never the real one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scales', nargs='*', default=['1k', '10k'],
+                            help="Catalogue sizes, e.g. 1k 10k 100k 1m or plain numbers (default: 1k 10k)")
+        parser.add_argument('--procs', type=int, default=1, help='Indexing processes (default: 1)')
+        parser.add_argument('--repeat', type=int, default=REQUESTS_PER_SCENARIO,
+                            help=f'Requests per scenario (default: {REQUESTS_PER_SCENARIO})')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalogues (default: 0)')
+        parser.add_argument('--output', help='Write the results to this JSON file instead of the standard output')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = [
+                benchmark_scale(parse_scale(scale), options['procs'], options['repeat'], options['seed'])
+                for scale in options['scales']
+            ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = json.dumps({'database': connection.vendor, 'results': results}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.manga.jobs import claim_job, run_job
+
+# Constants
+POLL_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ('Runs the queued populate jobs in the background, resuming the interrupted ones from their last '
+            'checkpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more jobs to run')
+        parser.add_argument('--poll', type=float, default=POLL_INTERVAL,
+                            help=f'Seconds between checks for new jobs (default: {POLL_INTERVAL})')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_job()
+            if job:
+                run_job(job)
+                self.stdout.write(f"Job {job.pk}: {job.status}")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll'])
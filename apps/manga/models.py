@@ -25,10 +25,16 @@ class Manga(models.Model):
     author = models.ForeignKey(Author, on_delete=models.CASCADE, verbose_name='Author')
     release_year = models.PositiveIntegerField(verbose_name='Release Year', null=True, blank=True)
     image_link = models.URLField(validators=[URLValidator()], verbose_name='Image Link')
-    details_link = models.URLField(validators=[URLValidator()], verbose_name='Details Link')
+    thumbnail_link = models.CharField(max_length=200, verbose_name='Thumbnail Link', blank=True, default='')
+    thumbnail_webp_link = models.CharField(max_length=200, verbose_name='WebP Thumbnail Link', blank=True, default='')
+    details_link = models.URLField(validators=[URLValidator()], verbose_name='Details Link', db_index=True)
     genres = models.ManyToManyField(Genre, verbose_name='Genres')
     num_caps = models.IntegerField(verbose_name='Number of Chapters')
     views = models.PositiveIntegerField(verbose_name='Views')
+    details_etag = models.CharField(max_length=200, verbose_name='Details ETag', blank=True, default='')
+    details_last_modified = models.CharField(max_length=100, verbose_name='Details Last-Modified', blank=True, default='')
+    details_hash = models.CharField(max_length=64, verbose_name='Details Hash', blank=True, default='')
+    cover_hash = models.CharField(max_length=64, verbose_name='Cover Hash', blank=True, default='')
 
     def __str__(self):
         return self.title
@@ -47,6 +53,33 @@ class Score(models.Model):
         ordering = ['manga']
 
 
+class PopulateJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Status')
+    base_url = models.CharField(max_length=200, verbose_name='Base URL')
+    max_pages = models.PositiveIntegerField(verbose_name='Max Pages')
+    delta = models.BooleanField(default=False, verbose_name='Delta')
+    next_page = models.PositiveIntegerField(default=1, verbose_name='Next Page')
+    mangas_crawled = models.PositiveIntegerField(default=0, verbose_name='Mangas Crawled')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Attempts')
+    error = models.TextField(blank=True, default='', verbose_name='Error')
+    stats = models.JSONField(blank=True, default=dict, verbose_name='Stats')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Created At')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Updated At')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Finished At')
 
+    def __str__(self):
+        return f'{self.pk} ({self.status})'
+
+    @property
+    def pages_done(self):
+        return self.next_page - 1
 
+    class Meta:
+        ordering = ['created_at']
 
@@ -1,17 +1,32 @@
+import asyncio
+import hashlib
+import json
 import logging
 import os
-from io import BytesIO
+import queue
+import threading
+import time
+from collections import deque
 
 import requests
-from bs4 import BeautifulSoup
 from django.db import transaction
 
+from apps.manga.covers import store_cover
+from apps.manga.crawler import CRAWL_CONCURRENCY, CRAWL_PER_HOST, Crawler
+from apps.manga.extraction import parse_category_page, parse_details_page
+from apps.manga.import_stats import ImportStats
 from apps.manga.models import Author, Genre, Manga
 
 logging.basicConfig(level=logging.INFO)
 
 BASE_URL = 'https://my.ninemanga.com/category/index_{}.html'
 MAX_PAGES = 100
+IMPORT_BATCH_SIZE = 500
+PAGES_IN_FLIGHT = 4
+PIPELINE_QUEUE_SIZE = 8
+VALIDATOR_FIELDS = ['details_etag', 'details_last_modified', 'details_hash', 'cover_hash']
+LISTING_FIELDS = ['title', 'views', 'image_link', 'thumbnail_link', 'thumbnail_webp_link', *VALIDATOR_FIELDS]
+DETAILS_FIELDS = [*LISTING_FIELDS, 'author', 'release_year', 'details_link', 'num_caps']
 
 
 def clean_database():
@@ -21,6 +36,7 @@ def clean_database():
     Author.objects.all().delete()
     Genre.objects.all().delete()
     Manga.objects.all().delete()
+    # Las portadas se guardan por su hash en img/covers y se conservan: el siguiente rastreo las reutiliza
     for file in os.listdir('apps/static/assets/img'):
         if file.startswith('Manga -'):
             os.remove(os.path.join('apps/static/assets/img', file))
@@ -49,175 +65,408 @@ def create_unknown_genre():
     return unknown_genre
 
 
-def get_or_create_author(name_author, all_authors, unknown_author):
+class CatalogueWriter:
     """
-    Retrieves or creates an author instance based on the provided name.
+    Accumulates crawled manga records and saves them in batches with bulk inserts and updates.
 
-    Parameters:
-        name_author (Tag): BeautifulSoup Tag representing the author name.
-        all_authors (Dict[str, Author]): Dictionary to cache already created authors.
-        unknown_author (Author): The 'Unknown' author instance.
+    Each flush creates the authors and genres not seen before, then inserts the new mangas and updates the known ones,
+    matched by details link, with one bulk query per table instead of one query per row. Known mangas whose details
+    page did not change only get their listing fields updated, so their genres are left untouched. Authors and genres
+    are cached by name for the whole import. Flushes are timed as the 'db' stage of the import stats.
+    """
+
+    def __init__(self, unknown_author, unknown_genre, batch_size=IMPORT_BATCH_SIZE, known=None, stats=None):
+        self.unknown_author = unknown_author
+        self.unknown_genre = unknown_genre
+        self.batch_size = batch_size
+        self.known = known or {}
+        self.stats = stats or ImportStats()
+        self.authors = {author.name: author for author in Author.objects.all()}
+        self.genres = {genre.name: genre for genre in Genre.objects.all()}
+        self.records = []
+        self.seen = set()
+
+    def add(self, record):
+        """
+        Queues a record until the next flush. Mangas listed twice are saved once.
+
+        Parameters:
+            record (dict): The record, as returned by crawl_manga.
+        """
+        if record['details_link'] in self.seen:
+            return
+        self.seen.add(record['details_link'])
+        self.records.append(record)
+
+    def flush(self):
+        """
+        Saves every queued record.
+        """
+        records, self.records = self.records, []
+        if not records:
+            return
+        with self.stats.time('db', len(records)):
+            rows = self._save(records)
+        self.stats.add('db', rows=rows)
+        logging.debug(f"Saved {len(records)} mangas in {rows} rows")
+
+    def _save(self, records):
+        # Devuelve las filas escritas en todas las tablas, no solo los mangas
+        changed = [record for record in records if record['details_changed']]
+        author_names = [record['author_name'] for record in changed if record['author_name']]
+        rows = self._create_missing(Author, self.authors, author_names)
+        rows += self._create_missing(Genre, self.genres, [name for record in changed for name in record['genre_names']])
+
+        new_records = [record for record in records if record['details_link'] not in self.known]
+        mangas = [self._manga(record) for record in new_records]
+        self._bulk_create_with_pks(Manga, mangas)
+
+        updated_records = [record for record in changed if record['details_link'] in self.known]
+        updated = [self._manga(record, self.known[record['details_link']]['pk']) for record in updated_records]
+        Manga.objects.bulk_update(updated, DETAILS_FIELDS, batch_size=self.batch_size)
+        refreshed = [
+            Manga(pk=self.known[record['details_link']]['pk'], **{field: record[field] for field in LISTING_FIELDS})
+            for record in records
+            if record['details_link'] in self.known and not record['details_changed']
+        ]
+        Manga.objects.bulk_update(refreshed, LISTING_FIELDS, batch_size=self.batch_size)
+        rows += len(mangas) + len(updated) + len(refreshed)
+
+        through = Manga.genres.through
+        rows += through.objects.filter(manga_id__in=[manga.pk for manga in updated]).delete()[0]
+        links = []
+        for manga, record in zip(mangas + updated, new_records + updated_records):
+            genres = [self.genres[name] for name in dict.fromkeys(record['genre_names'])] or [self.unknown_genre]
+            links.extend(through(manga_id=manga.pk, genre_id=genre.pk) for genre in genres)
+        through.objects.bulk_create(links, batch_size=self.batch_size)
+        return rows + len(links)
+
+    def _manga(self, record, pk=None):
+        return Manga(
+            pk=pk,
+            author=self.authors[record['author_name']] if record['author_name'] else self.unknown_author,
+            **{field: record[field] for field in DETAILS_FIELDS if field != 'author'},
+        )
+
+    def _create_missing(self, model, cache, names):
+        missing = [name for name in dict.fromkeys(names) if name not in cache]
+        if missing:
+            objects = [model(name=name) for name in missing]
+            self._bulk_create_with_pks(model, objects)
+            cache.update(zip(missing, objects))
+        return len(missing)
+
+    def _bulk_create_with_pks(self, model, objects):
+        # Only some backends (e.g. PostgreSQL) return the primary keys of bulk inserts. Elsewhere the new rows are
+        # read back: every flush runs in a transaction and only the import inserts catalogue rows, so they are the
+        # rows after the previous highest key.
+        last_pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        if objects and objects[-1].pk is None:
+            new_pks = model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)
+            for obj, pk in zip(objects, new_pks):
+                obj.pk = pk
+
+
+def load_known_mangas():
+    """
+    Loads what the previous crawls stored about each manga, to crawl only what changed since then.
 
     Returns:
-        Author: The author instance.
+        dict: The primary key, validators and hashes of each manga, by details link.
     """
-    if name_author:
-        name_author = name_author.find_next('a').text.strip()
-        author = all_authors.setdefault(name_author, Author(name=name_author))
-        if not author.pk:
-            author.save()
-            all_authors[name_author] = author
-    else:
-        author = unknown_author
-    return author
+    known = {}
+    for manga in Manga.objects.order_by('pk').values('pk', 'details_link', *VALIDATOR_FIELDS):
+        known.setdefault(manga['details_link'], manga)
+    return known
 
 
-def get_or_create_genres(names_genres, all_genres, unknown_genre):
+def content_hash(content):
     """
-    Retrieves or creates genre instances based on the provided genre names.
+    Returns the SHA-256 hex digest of downloaded content.
 
     Parameters:
-        names_genres (Tag): BeautifulSoup Tag representing the genre names.
-        all_genres (Dict[str, Genre]): Dictionary to cache already created genres.
-        unknown_genre (Genre): The 'Unknown' genre instance.
+        content (bytes): The content.
 
     Returns:
-        List[Genre]: List of genre instances.
+        str: The digest.
     """
-    genres = []
-    if names_genres:
-        names_genres = [genre.text for genre in names_genres.find_all('a')]
-        for name_genre in names_genres:
-            genre = all_genres.setdefault(name_genre, Genre(name=name_genre))
-            if not genre.pk:
-                genre.save()
-                all_genres[name_genre] = genre
-            genres.append(genre)
-    else:
-        genres.append(unknown_genre)
-    return genres
+    return hashlib.sha256(content).hexdigest()
 
 
-def create_and_save_manga(title, author, release_year, image_link, details_link, num_caps, views, genres):
+async def fetch_page(crawler, stats, url, headers=None):
     """
-    Creates and saves a Manga instance.
+    Downloads a URL with the crawler, timing the download as the 'fetch' stage and counting its bytes and cache hits.
+    The wait for a free crawler slot is counted apart, as the queue_seconds of the stage.
 
     Parameters:
-        title (str): The title of the manga.
-        author (Author): The author instance.
-        release_year (int): The release year of the manga.
-        image_link (str): The link to the manga's cover image.
-        details_link (str): The link to the details page of the manga.
-        num_caps (int): The number of chapters in the manga.
-        views (int): The number of views the manga has.
-        genres (List[Genre]): List of genre instances.
-    """
-    m = Manga(
-        title=title,
-        author=author,
-        release_year=release_year,
-        image_link=image_link,
-        details_link=details_link,
-        num_caps=num_caps,
-        views=views
-    )
-    m.save()
-    m.genres.set(genres)
-    logging.info(
-        f"Title: {title}, Author: {author.name}, Release Year: {release_year}, Image Link: {image_link}, Details Link: {details_link}"
-    )
+        crawler (Crawler): The crawler to fetch with.
+        stats (ImportStats): The stats of the import.
+        url (str): The URL to download.
+        headers (dict, optional): Extra request headers. Defaults to None.
+
+    Returns:
+        requests.Response: The response.
+    """
+    queued = time.perf_counter()
+    async with crawler.slot(url):
+        stats.add('fetch', queue_seconds=time.perf_counter() - queued)
+        with stats.time('fetch'):
+            response = await crawler.get(url, headers)
+    stats.add('fetch', bytes=len(response.content), cached=int(getattr(response, 'from_cache', False)))
+    return response
 
 
-@transaction.atomic
-def populate_mangas():
+async def crawl_manga(crawler, entry, known=None, stats=None):
     """
-    Populates the database with manga information by scraping pages from the BASE_URL.
+    Downloads the details page and the cover of a manga at the same time.
+
+    When the manga was crawled before, the details page is requested conditionally and only parsed if its content
+    changed. Covers go through store_cover, which only writes the images not stored yet.
+
+    Parameters:
+        crawler (Crawler): The crawler to fetch with.
+        entry (dict): The manga as returned by parse_category_page.
+        known (dict, optional): What the previous crawl stored about the manga, as returned by load_known_mangas.
+        stats (ImportStats, optional): The stats of the import.
+
+    Returns:
+        dict: The complete manga record, ready to be saved. 'details_changed' tells whether the details were parsed.
     """
-    clean_database()
-    unknown_author = create_unknown_author()
-    unknown_genre = create_unknown_genre()
+    known = known or {}
+    stats = stats or ImportStats()
+    headers = {}
+    if known.get('details_etag'):
+        headers['If-None-Match'] = known['details_etag']
+    if known.get('details_last_modified'):
+        headers['If-Modified-Since'] = known['details_last_modified']
+    details_response, image_response = await asyncio.gather(
+        fetch_page(crawler, stats, entry['details_link'] + "?waring=1", headers),
+        fetch_page(crawler, stats, entry['image_url']),
+    )
 
-    all_authors = {}
-    all_genres = {}
+    record = {**entry, 'details_changed': False, **{field: known.get(field, '') for field in VALIDATOR_FIELDS}}
+    if details_response.status_code != 304:
+        record['details_etag'] = details_response.headers.get('ETag', '')
+        record['details_last_modified'] = details_response.headers.get('Last-Modified', '')
+        record['details_hash'] = content_hash(details_response.content)
+        if record['details_hash'] != known.get('details_hash'):
+            with stats.time('parse'):
+                record.update(parse_details_page(details_response.text), details_changed=True)
 
-    with requests.Session() as session:
-        for page in range(1, MAX_PAGES + 1):
-            process_page(page, all_authors, all_genres, unknown_author, unknown_genre, session)
+    with stats.time('covers'):
+        record.update(await crawler.run(store_cover, image_response.content))
+    return record
 
 
-def process_page(page, all_authors, all_genres, unknown_author, unknown_genre, session):
+async def crawl_page(crawler, page, base_url=BASE_URL, known=None, stats=None):
     """
-    Processes a page from the BASE_URL, scraping manga information and saving it to the database.
+    Downloads a category page and then every manga it lists concurrently.
 
     Parameters:
+        crawler (Crawler): The crawler to fetch with.
         page (int): The page number.
-        all_authors (Dict[str, Author]): Dictionary to cache already created authors.
-        all_genres (Dict[str, Genre]): Dictionary to cache already created genres.
-        unknown_author (Author): The 'Unknown' author instance.
-        unknown_genre (Genre): The 'Unknown' genre instance.
-        session: The requests session.
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        known (dict, optional): The mangas stored by previous crawls, as returned by load_known_mangas.
+        stats (ImportStats, optional): The stats of the import.
+
+    Returns:
+        List[dict]: The records of the mangas that could be downloaded, in page order.
     """
+    stats = stats or ImportStats()
     try:
-        url = BASE_URL.format(page)
-        response = session.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'lxml')
-
-        mangas = soup.find('ul', class_='direlist').find_all('dl', 'bookinfo')
-
-        for manga in mangas:
-            process_manga(manga, all_authors, all_genres, unknown_author, unknown_genre, session)
-
+        response = await fetch_page(crawler, stats, base_url.format(page))
+        with stats.time('parse'):
+            entries = parse_category_page(response.text)
     except requests.exceptions.RequestException as e:
         logging.error(f"Error en la página {page}: {str(e)}")
+        return []
+
+    known = known or {}
+    records = await asyncio.gather(
+        *(crawl_manga(crawler, entry, known.get(entry['details_link']), stats) for entry in entries), return_exceptions=True
+    )
+    for entry, record in zip(entries, records):
+        if isinstance(record, Exception):
+            logging.error(f"Error en el manga {entry['title']}: {record}")
+    return [record for record in records if not isinstance(record, Exception)]
 
 
-def process_manga(manga, all_authors, all_genres, unknown_author, unknown_genre, session):
+async def produce_pages(pages, results, stop, base_url=BASE_URL, known=None, concurrency=CRAWL_CONCURRENCY,
+                        per_host=CRAWL_PER_HOST, stats=None):
     """
-    Processes a manga from the BASE_URL, scraping its details and saving it to the database.
+    Crawls category pages, PAGES_IN_FLIGHT at a time, and puts the records of each one into a queue in page order.
 
     Parameters:
-        manga: The BeautifulSoup Tag representing the manga information.
-        all_authors (Dict[str, Author]): Dictionary to cache already created authors.
-        all_genres (Dict[str, Genre]): Dictionary to cache already created genres.
-        unknown_author (Author): The 'Unknown' author instance.
-        unknown_genre (Genre): The 'Unknown' genre instance.
-        session: The requests session.
+        pages (List[int]): The page numbers to crawl.
+        results (queue.Queue): The queue receiving a (page, records) tuple per page. When it is full, no more pages
+            are started until the consumer catches up.
+        stop (threading.Event): Set by the consumer to stop the crawl early.
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        known (dict, optional): The mangas stored by previous crawls, as returned by load_known_mangas.
+        concurrency (int, optional): The maximum number of requests in flight. Defaults to CRAWL_CONCURRENCY.
+        per_host (int, optional): The maximum number of requests in flight per host. Defaults to CRAWL_PER_HOST.
+        stats (ImportStats, optional): The stats of the import.
     """
-    title = manga.find('a', class_='bookname').text
-    details_link = manga.find('a', class_='bookname')['href']
-    image_link = manga.find('img')['src']
-    image_content = BytesIO(requests.get(image_link).content)
-    save_title = title.replace('/', '_')
-    file = f'apps/static/assets/img/Manga - {save_title}.png'
-    # Guarda la imagen como png en la carpeta data
-    with open(file, 'wb') as f:
-        f.write(image_content.getvalue())
-
-
-    views = int(manga.find('span').text.replace('views', '').replace(',', '').strip())
-
-    details_response = session.get(details_link + "?waring=1")
-    details_response.raise_for_status()
-    details_soup = BeautifulSoup(details_response.text, 'lxml')
-    name_author = details_soup.find('b', string='Autor(s):')
-    release_year = details_soup.find('b', string='Año')
+    loop = asyncio.get_running_loop()
+    in_flight = deque()
+
+    async def emit():
+        page, task = in_flight.popleft()
+        await loop.run_in_executor(None, put_until_stopped, results, stop, (page, await task))
+
+    with Crawler(concurrency, per_host) as crawler:
+        try:
+            for page in pages:
+                if stop.is_set():
+                    break
+                in_flight.append((page, asyncio.ensure_future(crawl_page(crawler, page, base_url, known, stats))))
+                if len(in_flight) >= PAGES_IN_FLIGHT:
+                    await emit()
+            while in_flight and not stop.is_set():
+                await emit()
+        finally:
+            for _, task in in_flight:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+
+
+def put_until_stopped(results, stop, item):
+    """
+    Puts an item into a bounded queue, waiting while it is full unless the consumer stops.
 
-    release_year = int(release_year.find_next('a').text) if release_year else None
+    Parameters:
+        results (queue.Queue): The queue.
+        stop (threading.Event): Set by the consumer once it stops reading.
+        item (object): The item.
+    """
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
 
-    names_genres = details_soup.find('li', itemprop='genre')
-    sections = details_soup.find_all('ul', class_='sub_vol_ul')
-    caps = [cap for section in sections for cap in section.find_all('a')]
-    num_caps = len(caps)
 
-    author = get_or_create_author(name_author, all_authors, unknown_author)
-    genres = get_or_create_genres(names_genres, all_genres, unknown_genre)
+def iter_crawled_pages(pages, base_url=BASE_URL, known=None, queue_size=PIPELINE_QUEUE_SIZE,
+                       concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST, stats=None):
+    """
+    Crawls category pages in a background thread, yielding the records of each page in page order as soon as they are
+    ready, so they can be saved while the next pages are downloaded.
 
-    create_and_save_manga(title, author, release_year, file.replace('apps/static/assets/', ''), details_link, num_caps, views, genres)
+    The crawl runs ahead of the consumer by at most `queue_size` pages, and stops when the consumer does, e.g. when
+    saving a page fails.
 
+    Parameters:
+        pages (Iterable[int]): The page numbers to crawl.
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        known (dict, optional): The mangas stored by previous crawls, as returned by load_known_mangas.
+        queue_size (int, optional): The number of crawled pages waiting to be consumed at most. Defaults to
+            PIPELINE_QUEUE_SIZE.
+        concurrency (int, optional): The maximum number of requests in flight. Defaults to CRAWL_CONCURRENCY.
+        per_host (int, optional): The maximum number of requests in flight per host. Defaults to CRAWL_PER_HOST.
+        stats (ImportStats, optional): The stats of the import.
+
+    Yields:
+        Tuple[int, List[dict]]: The page number and the records of its mangas.
+    """
+    pages = list(pages)
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            asyncio.run(produce_pages(pages, results, stop, base_url, known, concurrency, per_host, stats))
+        except Exception as e:
+            put_until_stopped(results, stop, e)
+        put_until_stopped(results, stop, done)
+
+    thread = threading.Thread(target=produce, name='crawl-pages', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def import_pages(pages, writer, base_url=BASE_URL, known=None, batch_size=IMPORT_BATCH_SIZE, checkpoint=None):
+    """
+    Crawls category pages and saves their mangas while the next pages are being crawled.
 
+    Records are saved in a transaction per batch of at least `batch_size` records, flushed at page boundaries, so
+    other requests can write between batches and a failure only loses the batch in progress.
 
+    Parameters:
+        pages (Iterable[int]): The page numbers to crawl.
+        writer (CatalogueWriter): The writer saving the records.
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        known (dict, optional): The mangas stored by previous crawls, as returned by load_known_mangas.
+        batch_size (int, optional): The number of records per transaction. Defaults to IMPORT_BATCH_SIZE.
+        checkpoint (Callable[[int, int], None], optional): Called inside each batch's transaction with the last page
+            of the batch and its number of crawled records, e.g. to save the progress of a job.
 
+    Returns:
+        ImportStats: The stats of the import, shared with the writer.
+    """
+    last_page = None
+    crawled = 0
+
+    def commit():
+        with transaction.atomic():
+            writer.flush()
+            if checkpoint:
+                checkpoint(last_page, crawled)
+
+    for page, records in iter_crawled_pages(pages, base_url, known, stats=writer.stats):
+        for record in records:
+            writer.add(record)
+        last_page = page
+        crawled += len(records)
+        if len(writer.records) >= batch_size:
+            commit()
+            last_page, crawled = None, 0
+    if last_page is not None:
+        commit()
+    return writer.stats
+
+
+def populate_mangas(base_url=BASE_URL, max_pages=MAX_PAGES, delta=False, batch_size=IMPORT_BATCH_SIZE, start_page=1,
+                    checkpoint=None, stats=None):
+    """
+    Populates the database with manga information by scraping pages from the BASE_URL.
 
+    Parameters:
+        base_url (str, optional): The category URL template. Defaults to BASE_URL.
+        max_pages (int, optional): The number of category pages to crawl. Defaults to MAX_PAGES.
+        delta (bool, optional): Whether to update the stored mangas in place, keyed by details link, instead of
+            wiping the catalogue first. Unchanged details pages and covers are skipped and the scores are kept.
+            Defaults to False.
+        batch_size (int, optional): The number of records saved per transaction. Defaults to IMPORT_BATCH_SIZE.
+        start_page (int, optional): The first page to crawl, e.g. to resume an interrupted import. The catalogue is
+            only wiped when starting from page 1. Defaults to 1.
+        checkpoint (Callable[[int, int], None], optional): Called after each batch, see import_pages.
+        stats (ImportStats, optional): The stats to update, e.g. to read them from the checkpoint.
 
+    Returns:
+        dict: The summary of the import stats.
+    """
+    if start_page == 1 and not delta:
+        with transaction.atomic():
+            clean_database()
+    known = load_known_mangas()
+    unknown_author = create_unknown_author()
+    unknown_genre = create_unknown_genre()
 
+    writer = CatalogueWriter(unknown_author, unknown_genre, batch_size, known, stats)
+    pages = range(start_page, max_pages + 1)
+    summary = import_pages(pages, writer, base_url, known, batch_size, checkpoint).summary()
+    logging.info(f"Import summary: {json.dumps(summary)}")
+    return summary
@@ -0,0 +1,639 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from itertools import islice
+from math import ceil
+
+from django.core.paginator import Page, Paginator
+from whoosh.analysis import LowercaseFilter, RegexTokenizer
+from whoosh.index import open_dir
+from whoosh.qparser import QueryParser
+from whoosh.query import And, Every, NullQuery, NumericRange, Term
+from whoosh.sorting import Count, FieldFacet
+
+from apps.manga.create_index import AUTOCOMPLETE_MAX_CHARS, AUTOCOMPLETE_MIN_CHARS, INDEX_PATH
+from apps.manga.models import Author, Manga
+
+# Constants
+PAGE_SIZE = 12
+MIN_YEAR = 0
+MAX_YEAR = 3000
+MAX_FILTER_DOCS = 500000
+MAX_CACHED_IDS = 100000
+RESULT_CACHE_DEPTH = 240
+RESULT_CACHE_TTL = 300
+AUTOCOMPLETE_LIMIT = 8
+MAX_AUTOCOMPLETE_ENTRIES = 4096
+FACETS = {
+    'genres': FieldFacet('genres', allow_overlap=True),
+    'release_year': FieldFacet('release_year'),
+}
+# Orderings accepted by the sort parameter, besides relevance, all from the highest value down
+SORTS = {
+    'views': FieldFacet('views', reverse=True),
+    'year': FieldFacet('release_year', reverse=True),
+    'chapters': FieldFacet('num_caps', reverse=True),
+}
+
+
+class SearcherCache:
+    """
+    Keeps the Whoosh index open for the whole life of the worker and hands out searchers that are reused across
+    requests.
+
+    The index object is shared by every thread, while each thread keeps its own searcher because Whoosh readers
+    are not safe to use concurrently. Before a searcher is handed out it is refreshed if the index generation
+    changed, e.g. after index_all_mangas committed a rebuild; unchanged segments are reused by the refresh.
+    """
+
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        self._index = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def index(self):
+        """
+        Returns the shared index, opening it on first use.
+
+        Returns:
+            whoosh.index.Index: The open index.
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = open_dir(self.index_path)
+        return self._index
+
+    def searcher(self):
+        """
+        Returns the calling thread's searcher, refreshed to the latest index generation.
+
+        The searcher belongs to the cache and must not be closed by the caller.
+
+        Returns:
+            whoosh.searching.Searcher: An up to date searcher.
+        """
+        searcher = getattr(self._local, 'searcher', None)
+        if searcher is None:
+            searcher = self.index().searcher()
+        elif not searcher.up_to_date():
+            searcher = searcher.refresh()
+        self._local.searcher = searcher
+        return searcher
+
+    def reset(self, index_path=None):
+        """
+        Forgets the open index and searchers, so the next searcher opens the index again.
+
+        Parameters:
+            index_path (str, optional): A different index directory to use from now on.
+        """
+        with self._lock:
+            if index_path is not None:
+                self.index_path = index_path
+            if self._index is not None:
+                self._index.close()
+            self._index = None
+            self._local = threading.local()
+
+
+searcher_cache = SearcherCache()
+
+
+def get_searcher():
+    """
+    Returns a searcher over the manga index from the process-wide cache.
+
+    Returns:
+        whoosh.searching.Searcher: An up to date searcher that must not be closed by the caller.
+    """
+    return searcher_cache.searcher()
+
+
+class GenerationCache:
+    """
+    An LRU cache for values computed from one index generation, such as filter document sets or search results.
+
+    Document numbers and results are only meaningful for one index generation, so the cache is emptied when a
+    searcher over a newer generation uses it. Searchers still on an older generation neither read nor fill it.
+    Each value has a weight (1 by default) and the least recently used values are evicted once the total weight
+    exceeds max_size. Values older than ttl seconds, when given, are treated as missing.
+    """
+
+    def __init__(self, max_size, ttl=None, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.weigh = weigh or (lambda value: 1)
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._size = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _sync(self, searcher):
+        generation = searcher.reader().generation()
+        if self._generation is None or generation > self._generation:
+            self._values.clear()
+            self._size = 0
+            self._generation = generation
+        return generation == self._generation
+
+    def _discard(self, key):
+        _, weight, _ = self._values.pop(key)
+        self._size -= weight
+
+    def get(self, searcher, key):
+        """
+        Returns the value cached for a key.
+
+        Parameters:
+            searcher (whoosh.searching.Searcher): The searcher the value would be computed with.
+            key (Hashable): The cache key.
+
+        Returns:
+            object or None: The cached value, or None if it is not cached for the searcher's generation.
+        """
+        with self._lock:
+            if self._sync(searcher) and key in self._values:
+                expires_at, _, value = self._values[key]
+                if expires_at is None or expires_at > time.monotonic():
+                    self._values.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+            self.misses += 1
+        return None
+
+    def set(self, searcher, key, value):
+        """
+        Caches a value computed with a searcher.
+
+        Parameters:
+            searcher (whoosh.searching.Searcher): The searcher the value was computed with.
+            key (Hashable): The cache key.
+            value (object): The value to cache. It is shared between requests and must not be modified.
+        """
+        weight = self.weigh(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if self._sync(searcher) and weight <= self.max_size:
+                if key in self._values:
+                    self._discard(key)
+                self._values[key] = (expires_at, weight, value)
+                self._size += weight
+                while self._size > self.max_size:
+                    self._discard(next(iter(self._values)))
+
+    def clear(self):
+        """
+        Empties the cache and resets its counters, e.g. after switching to another index.
+        """
+        with self._lock:
+            self._values.clear()
+            self._size = 0
+            self._generation = None
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the usage counters of the cache, to help choosing its size.
+
+        Returns:
+            dict: The hits, misses, number of entries, total weight and maximum weight.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._values),
+                'size': self._size,
+                'max_size': self.max_size,
+            }
+
+
+# Weighted by the number of document numbers stored in each set
+filter_cache = GenerationCache(MAX_FILTER_DOCS, weigh=lambda docs: len(docs) + 1)
+# Weighted by the number of manga ids stored in each entry
+result_cache = GenerationCache(MAX_CACHED_IDS, ttl=RESULT_CACHE_TTL, weigh=lambda entry: len(entry['ids']) + 1)
+autocomplete_cache = GenerationCache(MAX_AUTOCOMPLETE_ENTRIES)
+
+
+def filter_docs(searcher, query, cached=True):
+    """
+    Returns the documents matching a genre or release year filter, reusing the sets cached for the index generation.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher the document numbers belong to.
+        query (whoosh.query.Query): The filter query, also used as the cache key.
+        cached (bool, optional): Whether to look the set up in filter_cache and store it there. Defaults to True.
+
+    Returns:
+        set: The matching document numbers. The set is shared and must not be modified.
+    """
+    docs = filter_cache.get(searcher, query) if cached else None
+    if docs is None:
+        docs = set(searcher.docs_for_query(query))
+        if cached:
+            filter_cache.set(searcher, query, docs)
+    return docs
+
+
+def is_decade_range(start_year, end_year):
+    """
+    Tells whether a release year filter covers whole decades, like the ones offered by the decade facet.
+
+    Parameters:
+        start_year (int or None): The first year, or None for no lower bound.
+        end_year (int or None): The last year, or None for no upper bound.
+
+    Returns:
+        bool: True if both bounds are missing or fall on decade boundaries.
+    """
+    return (start_year is None or start_year % 10 == 0) and (end_year is None or end_year % 10 == 9)
+
+
+def parse_year(value):
+    """
+    Converts a year parameter into an integer within MIN_YEAR and MAX_YEAR.
+
+    Parameters:
+        value (str): The year as received in the request.
+
+    Returns:
+        int or None: The clamped year, or None if the value is missing or not a number.
+    """
+    try:
+        return min(max(int(value), MIN_YEAR), MAX_YEAR)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filters(params):
+    """
+    Normalizes the filters of a listing request.
+
+    Parameters:
+        params (django.http.QueryDict): The GET parameters of the request.
+
+    Returns:
+        dict: The title and author texts, the sorted tuple of genres, the start and end years and the sort order,
+        which is empty for relevance.
+    """
+    # Los géneros pueden llegar como varios parámetros o separados por comas
+    genres = {genre.strip() for value in params.getlist('genre') for genre in value.split(',')}
+    return {
+        'title': (params.get('title') or '').strip().lower(),
+        'author': (params.get('author') or '').strip().lower(),
+        'genres': tuple(sorted(genre for genre in genres if genre)),
+        'start_year': parse_year(params.get('start_year')),
+        'end_year': parse_year(params.get('end_year')),
+        'sort': params.get('sort') if params.get('sort') in SORTS else '',
+    }
+
+
+def build_text_query(schema, filters):
+    """
+    Builds the query for the free-text filters. Only the title and author texts go through the query parser.
+
+    Parameters:
+        schema (whoosh.fields.Schema): The schema of the index.
+        filters (dict): The normalized filters, as returned by parse_filters.
+
+    Returns:
+        whoosh.query.Query: The text query, or a query matching every manga when there is no text to match.
+    """
+    parts = []
+    if filters['title']:
+        parts.append(QueryParser('title', schema).parse(filters['title']))
+    if filters['author']:
+        parts.append(QueryParser('author_name', schema).parse(filters['author']))
+    if not parts:
+        return Every()
+    return And(parts) if len(parts) > 1 else parts[0]
+
+
+def build_filters(searcher, filters):
+    """
+    Builds the sets of documents allowed by the genre filter and by the release year filter from cached per-filter
+    sets. Only genre sets and decade-aligned year ranges are cached; other year ranges are looked up on every search.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher the filters will be used with.
+        filters (dict): The normalized filters, as returned by parse_filters.
+
+    Returns:
+        Tuple[set, set]: The document numbers allowed by the genres, any of which may match, and by the years. Each
+        one is None if its filter was not given.
+    """
+    genre_docs = None
+    if filters['genres']:
+        genre_docs = set().union(*(filter_docs(searcher, Term('genres', genre)) for genre in filters['genres']))
+    year_docs = None
+    if filters['start_year'] is not None or filters['end_year'] is not None:
+        # Solo se guardan las décadas: cualquier URL puede pedir un rango de años distinto
+        year_docs = filter_docs(searcher, NumericRange('release_year', filters['start_year'], filters['end_year']),
+                                cached=is_decade_range(filters['start_year'], filters['end_year']))
+    return genre_docs, year_docs
+
+
+def intersect_filters(*docsets):
+    """
+    Combines filter document sets, any of which may be None for a filter that was not given.
+
+    Parameters:
+        *docsets (set or None): The document sets.
+
+    Returns:
+        set or None: The documents allowed by every set, or None if no set was given.
+    """
+    given = [docs for docs in docsets if docs is not None]
+    if not given:
+        return None
+    return given[0] if len(given) == 1 else set.intersection(*given)
+
+
+def count_groups(searcher, query, allowed, name):
+    """
+    Counts the matches of a query in each group of one of FACETS, without ranking them.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher to run the query with.
+        query (whoosh.query.Query): The query.
+        allowed (set or None): The documents the matches are restricted to, or None for no restriction.
+        name (str): The name of the facet.
+
+    Returns:
+        dict: The number of matches of each group value.
+    """
+    # Whoosh ignores empty filters, but no manga can match them
+    if allowed is not None and not allowed:
+        return {}
+    results = searcher.search(query, limit=1, filter=allowed, groupedby={name: FACETS[name]}, maptype=Count,
+                              scored=False)
+    return results.groups(name)
+
+
+def parse_page_number(page, pagelen, doc_count):
+    """
+    Converts the raw page parameter into a valid page number.
+
+    Parameters:
+        page (str): The page number as received in the request.
+        pagelen (int): The number of hits per page.
+        doc_count (int): The number of documents in the index.
+
+    Returns:
+        int: A page number between 1 and the last page that could exist for the index.
+    """
+    try:
+        pagenum = int(page)
+    except (TypeError, ValueError):
+        pagenum = 1
+    last_page = max(1, ceil(doc_count / pagelen))
+    return min(max(pagenum, 1), last_page)
+
+
+def hydrate_ids(ids):
+    """
+    Loads the mangas with the given primary keys in a single query.
+
+    Parameters:
+        ids (Sequence[int]): The primary keys, in the order the mangas must be returned.
+
+    Returns:
+        List[Manga]: The mangas in the same order as the ids. Ids whose manga no longer exists are skipped.
+    """
+    mangas = Manga.objects.select_related('author').prefetch_related('genres').in_bulk(ids)
+    return [mangas[manga_id] for manga_id in ids if manga_id in mangas]
+
+
+def facet_counts(searcher, genre_counts, year_counts):
+    """
+    Summarizes the genre and release year groups of a search into the counts shown in the filter sidebar.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher the counts come from.
+        genre_counts (dict): The number of matching mangas of each genre.
+        year_counts (dict): The number of matching mangas of each release year.
+
+    Returns:
+        dict: 'genres' maps every indexed genre to its number of matching mangas, and 'decades' is a list of
+        (decade, count) pairs in chronological order. Mangas without a release year are left out of the decades.
+    """
+    genres = {name.decode('utf-8'): 0 for name in searcher.lexicon('genres')}
+    genres.update(genre_counts)
+    decades = Counter()
+    for year, count in year_counts.items():
+        # Los mangas sin año llegan con el valor por defecto de la columna, fuera del rango de años
+        if isinstance(year, int) and MIN_YEAR <= year <= MAX_YEAR:
+            decades[year // 10 * 10] += count
+    return {'genres': genres, 'decades': sorted(decades.items())}
+
+
+def search_mangas(searcher, filters, page, pagelen=PAGE_SIZE):
+    """
+    Searches the mangas matching the normalized filters of a listing request.
+
+    The first RESULT_CACHE_DEPTH manga ids, the total and the facet counts of each filter set are kept in
+    result_cache, so popular listings are served with a single database query. On a miss they are collected in one
+    search pass, plus an unranked counting pass for each facet whose own filter is set, and pages deeper than the
+    cached ids only search for the hits up to the requested page. Other orders than relevance are sorted inside the
+    searcher from the sortable columns, so only the hits up to the requested page are ranked and loaded.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher to run the search with.
+        filters (dict): The normalized filters, as returned by parse_filters.
+        page (str): The requested page number; invalid values fall back to the first page.
+        pagelen (int, optional): The number of mangas per page. Defaults to 12.
+
+    Returns:
+        Tuple[django.core.paginator.Page, dict]: A page with the hydrated mangas, usable like any other paginated
+        page, and the facet counts as returned by facet_counts. Genres are counted without the genre filter and
+        decades without the year filter, so the values that are not chosen keep their counts.
+    """
+    key = tuple(sorted(filters.items()))
+    cached = result_cache.get(searcher, key)
+    pagenum = parse_page_number(page, pagelen, cached['total'] if cached is not None else searcher.doc_count())
+    start, end = (pagenum - 1) * pagelen, pagenum * pagelen
+
+    if cached is not None and (end <= len(cached['ids']) or len(cached['ids']) == cached['total']):
+        ids = cached['ids'][start:end]
+    else:
+        genre_docs, year_docs = build_filters(searcher, filters)
+        allowed = intersect_filters(genre_docs, year_docs)
+        text_query = build_text_query(searcher.schema, filters)
+        # Whoosh ignores empty filters, but no manga can match them
+        query = NullQuery if allowed is not None and not allowed else text_query
+        sortedby = SORTS.get(filters['sort'])
+        if cached is None:
+            # Cada faceta se cuenta sin su propio filtro, para mostrar cuántos mangas añade marcar otro valor
+            groupedby = {name: facet for name, facet in FACETS.items()
+                         if (genre_docs if name == 'genres' else year_docs) is None}
+            results = searcher.search(query, limit=max(end, RESULT_CACHE_DEPTH), filter=allowed, sortedby=sortedby,
+                                      groupedby=groupedby or None, maptype=Count)
+            genre_counts = (results.groups('genres') if genre_docs is None
+                            else count_groups(searcher, text_query, year_docs, 'genres'))
+            year_counts = (results.groups('release_year') if year_docs is None
+                           else count_groups(searcher, text_query, genre_docs, 'release_year'))
+            cached = {
+                'total': len(results),
+                'ids': tuple(int(hit['manga_id']) for hit in results[:RESULT_CACHE_DEPTH]),
+                'facets': facet_counts(searcher, genre_counts, year_counts),
+            }
+            result_cache.set(searcher, key, cached)
+            pagenum = parse_page_number(page, pagelen, cached['total'])
+            start, end = (pagenum - 1) * pagelen, pagenum * pagelen
+        else:
+            results = searcher.search(query, limit=end, filter=allowed, sortedby=sortedby)
+        ids = [int(hit['manga_id']) for hit in results[start:end]]
+
+    paginator = Paginator(range(cached['total']), pagelen)
+    return Page(hydrate_ids(ids), pagenum, paginator), cached['facets']
+
+
+def text_words(text):
+    """
+    Splits a text into lowercase words, the way the NGRAMWORDS fields of manga_schema do.
+
+    Parameters:
+        text (str): The text.
+
+    Returns:
+        List[str]: The words.
+    """
+    return [token.text for token in (RegexTokenizer() | LowercaseFilter())(text)]
+
+
+def prefix_words(text):
+    """
+    Splits the text typed by the user into the lowercase words looked up in the NGRAMWORDS fields.
+
+    Parameters:
+        text (str): The text typed by the user.
+
+    Returns:
+        Tuple[str]: The words, cut to the longest prefix stored in the index.
+    """
+    words = (word[:AUTOCOMPLETE_MAX_CHARS] for word in text_words(text))
+    return tuple(word for word in words if len(word) >= AUTOCOMPLETE_MIN_CHARS)
+
+
+def prefix_query(fieldname, words):
+    """
+    Builds a query matching the documents where every word starts a word of the field.
+
+    Parameters:
+        fieldname (str): An NGRAMWORDS field of manga_schema.
+        words (Tuple[str]): The words, as returned by prefix_words.
+
+    Returns:
+        whoosh.query.Query: The query.
+    """
+    terms = [Term(fieldname, word) for word in words]
+    return And(terms) if len(terms) > 1 else terms[0]
+
+
+class AuthorNames:
+    """
+    The distinct names of the authors with mangas, kept in memory as a sorted list of (word, name) pairs, so the
+    names with a word starting with a prefix are found by bisection instead of scoring every manga of those authors.
+
+    The list is loaded from the database on first use and again when a searcher over a newer index generation uses
+    it, e.g. after a populate job rebuilt the index, so author suggestions change together with the titles.
+    """
+
+    def __init__(self):
+        self._entries = None
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def entries(self, searcher):
+        """
+        Returns the sorted (word, name) pairs, loading them if they are missing or the index changed.
+
+        Parameters:
+            searcher (whoosh.searching.Searcher): The searcher whose index generation the names must be as new as.
+
+        Returns:
+            List[Tuple[str, str]]: A pair for every word of every author name.
+        """
+        generation = searcher.reader().generation()
+        with self._lock:
+            if self._entries is None or generation > self._generation:
+                names = Author.objects.filter(manga__isnull=False).distinct().values_list('name', flat=True)
+                self._entries = sorted({(word, name) for name in names for word in text_words(name)})
+                self._generation = generation
+            return self._entries
+
+    def suggest(self, searcher, words, limit):
+        """
+        Returns the author names where every word starts a word of the name, in alphabetical order of the matched
+        word.
+
+        Parameters:
+            searcher (whoosh.searching.Searcher): The searcher of the request.
+            words (Tuple[str]): The words, as returned by prefix_words.
+            limit (int): The maximum number of names.
+
+        Returns:
+            List[str]: The distinct names.
+        """
+        entries = self.entries(searcher)
+        # Se recorren solo los nombres de la palabra que menos nombres comparten
+        start, stop = min(((bisect_left(entries, (word,)), bisect_left(entries, (word + '\uffff',))) for word in words),
+                          key=lambda bounds: bounds[1] - bounds[0])
+        names = []
+        for _, name in islice(entries, start, stop):
+            if name not in names and all(any(part.startswith(prefix) for part in text_words(name))
+                                         for prefix in words):
+                names.append(name)
+                if len(names) == limit:
+                    break
+        return names
+
+    def clear(self):
+        """
+        Forgets the loaded names, so the next lookup loads them again.
+        """
+        with self._lock:
+            self._entries = None
+            self._generation = None
+
+
+author_names = AuthorNames()
+
+
+def autocomplete(searcher, text, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Suggests manga titles and author names starting with the words typed by the user.
+
+    Titles are the first matches in index order, read from the posting lists without scoring, so looking them up
+    costs the same however many mangas match. Authors come from the in-memory author_names list. Typing sends the
+    same prefixes again and again, so the suggestions are cached per index generation.
+
+    Parameters:
+        searcher (whoosh.searching.Searcher): The searcher to look the prefixes up with.
+        text (str): The text typed by the user. Words shorter than AUTOCOMPLETE_MIN_CHARS are ignored.
+        limit (int, optional): The maximum number of titles and of authors to suggest. Defaults to 8.
+
+    Returns:
+        dict: 'titles' is a list of {'id', 'title'} dicts and 'authors' a list of distinct author names.
+    """
+    words = prefix_words(text)
+    if not words:
+        return {'titles': [], 'authors': []}
+    key = (words, limit)
+    suggestions = autocomplete_cache.get(searcher, key)
+    if suggestions is not None:
+        return suggestions
+
+    suggestions = {'titles': [], 'authors': author_names.suggest(searcher, words, limit)}
+    for docnum in islice(searcher.docs_for_query(prefix_query('title_prefixes', words)), limit):
+        fields = searcher.stored_fields(docnum)
+        suggestions['titles'].append({'id': int(fields['manga_id']), 'title': fields['title']})
+    autocomplete_cache.set(searcher, key, suggestions)
+    return suggestions
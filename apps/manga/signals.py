@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apps.manga.create_index import manga_indexer
+from apps.manga.models import Author, Genre, Manga
+
+
+def schedule_updates(manga_ids):
+    """
+    Queue mangas to be reindexed once the current transaction commits.
+
+    Parameters:
+        manga_ids (Iterable[int]): The primary keys of the changed mangas.
+    """
+    manga_ids = list(manga_ids)
+    transaction.on_commit(lambda: [manga_indexer.schedule_update(manga_id) for manga_id in manga_ids])
+
+
+@receiver(post_save, sender=Manga)
+def manga_saved(sender, instance, **kwargs):
+    schedule_updates([instance.pk])
+
+
+@receiver(post_delete, sender=Manga)
+def manga_deleted(sender, instance, **kwargs):
+    manga_id = instance.pk
+    transaction.on_commit(lambda: manga_indexer.schedule_delete(manga_id))
+
+
+@receiver(m2m_changed, sender=Manga.genres.through)
+def manga_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The mangas of a cleared genre are only known before the relation is removed
+        schedule_updates(instance.manga_set.values_list('pk', flat=True))
+    elif reverse and action in ('post_add', 'post_remove'):
+        schedule_updates(pk_set)
+    elif not reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        schedule_updates([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+    if not created:
+        schedule_updates(instance.manga_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, created, **kwargs):
+    if not created:
+        schedule_updates(instance.manga_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    # The cascade removes the relation rows without m2m_changed, so the mangas are only known before the delete
+    schedule_updates(instance.manga_set.values_list('pk', flat=True))
@@ -1,3 +1,354 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+import zipfile
+from io import BytesIO
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.contrib.auth.models import User
+from django.http import QueryDict
 from django.test import TestCase
 
-# Create your tests here.
+from apps.manga.chapter_cache import ChapterCache, chapter_fingerprint
+from apps.manga.downloader import iter_selected_chapters, stream_zip
+from apps.manga.create_index import INDEX_PATH, index_all_mangas, manga_indexer
+from apps.manga.http_cache import OFF, REPLAY, CacheMissError, ResponseCache, response_cache
+from apps.manga.http_client import http_client
+from apps.manga.jobs import job_status, run_job
+from apps.manga.models import Author, Genre, Manga, PopulateJob
+from apps.manga.populate_db import populate_mangas
+from apps.manga.search import (author_names, autocomplete, autocomplete_cache, filter_cache, parse_filters,
+                               result_cache, search_mangas, searcher_cache)
+
+# Constants
+SITE_PATH = os.path.join(os.path.dirname(__file__), 'testdata', 'site')
+SITE_PLACEHOLDER = b'http://stand-in'
+
+
+class SavedSiteHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the saved pages of SITE_PATH, pointing their absolute links at the running server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=SITE_PATH, **kwargs)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not path.endswith('.html'):
+            return super().do_GET()
+        try:
+            with open(path, 'rb') as f:
+                content = f.read().replace(SITE_PLACEHOLDER, self.server.base_url.encode())
+        except OSError:
+            return self.send_error(404)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PopulateTests(TestCase):
+    """
+    Crawls the saved category and details pages of SITE_PATH from a local stand-in server, without network.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), SavedSiteHandler)
+        cls.server.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        covers_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, covers_dir)
+        for patcher in (mock.patch('apps.manga.covers.COVERS_DIR', covers_dir),
+                        mock.patch.object(response_cache, 'mode', OFF),
+                        mock.patch.object(http_client, 'rate', 1000)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # El índice de búsqueda real no debe recibir el catálogo de prueba
+        suspended = manga_indexer.suspended()
+        suspended.__enter__()
+        self.addCleanup(suspended.__exit__, None, None, None)
+
+    def populate(self, **kwargs):
+        return populate_mangas(f'{self.server.base_url}/category/index_{{}}.html', max_pages=2, **kwargs)
+
+    def test_populate_imports_saved_pages(self):
+        summary = self.populate()
+
+        self.assertEqual(Manga.objects.count(), 6)
+        self.assertEqual(set(Author.objects.values_list('name', flat=True)), {'Tanaka', 'Sato', 'Kimura', 'Unknown'})
+        manga = Manga.objects.get(title='One Punch')
+        self.assertEqual(manga.author.name, 'Tanaka')
+        self.assertEqual(manga.release_year, 1991)
+        self.assertEqual(manga.num_caps, 3)
+        self.assertEqual(manga.views, 12500)
+        self.assertEqual(sorted(genre.name for genre in manga.genres.all()), ['Action', 'Comedy'])
+        self.assertEqual(manga.details_link, f'{self.server.base_url}/manga/m1.html')
+        # Sin autor ni géneros en la ficha
+        manga = Manga.objects.get(title='Paper Moon')
+        self.assertEqual(manga.author.name, 'Unknown')
+        self.assertEqual([genre.name for genre in manga.genres.all()], ['Unknown'])
+        self.assertIsNone(Manga.objects.get(title='Night Harbor').release_year)
+        self.assertEqual(Genre.objects.count(), 6)
+        for manga in Manga.objects.all():
+            self.assertTrue(manga.cover_hash)
+            self.assertTrue(os.path.exists(manga.image_link))
+        self.assertFalse(any(stage['errors'] for stage in summary['stages'].values()))
+        # 3 autores, 5 géneros, 6 mangas y 9 enlaces manga-género
+        self.assertEqual(summary['stages']['db']['rows'], 23)
+
+    def test_delta_populate_keeps_mangas_and_skips_unchanged_pages(self):
+        self.populate()
+        pks = dict(Manga.objects.values_list('details_link', 'pk'))
+
+        summary = self.populate(delta=True)
+
+        self.assertEqual(dict(Manga.objects.values_list('details_link', 'pk')), pks)
+        self.assertEqual(Manga.objects.get(title='Iron Path').genres.get().name, 'Action')
+        # Solo se analizan las dos páginas de categoría: ninguna ficha ha cambiado
+        self.assertEqual(summary['stages']['parse']['count'], 2)
+
+    def test_job_fails_when_indexing_fails_without_exposing_the_traceback(self):
+        job = PopulateJob.objects.create(base_url=f'{self.server.base_url}/category/index_{{}}.html', max_pages=2)
+
+        with mock.patch('apps.manga.jobs.index_all_mangas', side_effect=OSError('No space left on device')):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, PopulateJob.FAILED)
+        self.assertEqual(job_status(job)['error'], 'OSError: No space left on device')
+        self.assertEqual(Manga.objects.count(), 6)
+
+    def test_job_resumes_from_its_checkpoint(self):
+        populate_mangas(f'{self.server.base_url}/category/index_{{}}.html', max_pages=1)
+        pk = Manga.objects.get(title='One Punch').pk
+        job = PopulateJob.objects.create(base_url=f'{self.server.base_url}/category/index_{{}}.html', max_pages=2,
+                                         next_page=2)
+
+        with mock.patch('apps.manga.jobs.index_all_mangas'):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, PopulateJob.DONE)
+        self.assertEqual(job.next_page, 3)
+        # La página 1 no se vuelve a descargar ni se borra el catálogo ya guardado
+        self.assertEqual(job.stats['stages']['parse']['count'], 4)
+        self.assertEqual(Manga.objects.get(title='One Punch').pk, pk)
+        self.assertEqual(Manga.objects.count(), 6)
+
+    def test_job_is_kept_alive_while_the_index_is_rebuilt(self):
+        job = PopulateJob.objects.create(base_url=f'{self.server.base_url}/category/index_{{}}.html', max_pages=2)
+
+        with mock.patch('apps.manga.jobs.index_all_mangas', side_effect=lambda: time.sleep(0.3)), \
+                mock.patch('apps.manga.jobs.HEARTBEAT_EVERY', timedelta(seconds=0.05)), \
+                mock.patch('apps.manga.jobs.touch_job') as touch_job:
+            run_job(job)
+
+        # Una marca antes de indexar y varias mientras tanto
+        self.assertGreaterEqual(touch_job.call_count, 4)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PopulateJob.DONE)
+
+
+class DiskCacheTests(TestCase):
+    """
+    Checks the on-disk caches of rendered chapters and HTTP responses.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_chapter_cache_evicts_least_recently_used(self):
+        cache = ChapterCache(self.path, max_bytes=250)
+        cache.set('one-punch', 1, 'pdf', 'a', b'1' * 100)
+        cache.set('one-punch', 2, 'pdf', 'a', b'2' * 100)
+        # Se envejecen las entradas, la resolución de la fecha de acceso puede ser de segundos
+        for file, stat in cache._entries():
+            os.utime(file, (time.time() - 100, stat.st_mtime))
+        cache.get('one-punch', 1, 'pdf', 'a')
+
+        cache.set('one-punch', 3, 'pdf', 'a', b'3' * 100)
+
+        self.assertEqual(cache.get('one-punch', 1, 'pdf', 'a').getvalue(), b'1' * 100)
+        self.assertIsNone(cache.get('one-punch', 2, 'pdf', 'a'))
+        self.assertIsNone(cache.get('one-punch', 1, 'pdf', 'b'))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 2, 'hit_rate': 0.5, 'evictions': 1, 'bytes': 200})
+
+    def test_cached_chapters_are_served_without_opening_their_pages(self):
+        cache = ChapterCache(self.path)
+        for chapter in (1, 2):
+            link = f'http://stand-in/chapter/1-{chapter}.html'
+            cache.set('one-punch', chapter, 'pdf', chapter_fingerprint(link), b'%PDF chapter')
+        with open(os.path.join(SITE_PATH, 'manga', 'm1.html')) as f:
+            html = f.read()
+
+        with mock.patch('apps.manga.downloader.chapter_cache', cache), \
+                mock.patch('apps.manga.downloader.get_html', return_value=html), \
+                mock.patch('apps.manga.downloader.count_chapter_pages') as count_chapter_pages:
+            pdfs = dict(iter_selected_chapters('one-punch', [1, 2]))
+
+        self.assertEqual(sorted(pdfs), ['One Punch Chapter 1.0.pdf', 'One Punch Chapter 2.0.pdf'])
+        self.assertEqual(pdfs['One Punch Chapter 1.0.pdf'].getvalue(), b'%PDF chapter')
+        count_chapter_pages.assert_not_called()
+
+    def test_response_cache_replays_stored_responses(self):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = 'http://stand-in/manga/m1.html'
+        response.headers['ETag'] = '"m1"'
+        response.encoding = 'utf-8'
+        response._content = b'<html></html>'
+        ResponseCache(self.path).set(response.url, response)
+
+        cache = ResponseCache(self.path, ttl=0, mode=REPLAY)
+        cached = cache.get(response.url)
+
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(cached.content, b'<html></html>')
+        self.assertEqual(cached.headers['ETag'], '"m1"')
+        with self.assertRaises(CacheMissError):
+            cache.get('http://stand-in/manga/m2.html')
+        self.assertEqual(cache.stats()['mode'], REPLAY)
+
+    def test_cache_stats_is_for_staff_only(self):
+        User.objects.create_user('reader', password='secret')
+        User.objects.create_user('admin', password='secret', is_staff=True)
+
+        self.client.login(username='reader', password='secret')
+        self.assertEqual(self.client.get('/cache_stats').status_code, 302)
+        self.client.login(username='admin', password='secret')
+        stats = self.client.get('/cache_stats').json()
+
+        self.assertEqual(set(stats), {'chapters', 'responses'})
+
+
+class SearchTests(TestCase):
+    """
+    Searches a small catalogue indexed into a temporary directory.
+    """
+
+    def setUp(self):
+        index_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_path)
+        searcher_cache.reset(index_path)
+        self.addCleanup(searcher_cache.reset, INDEX_PATH)
+        for cache in (result_cache, filter_cache, autocomplete_cache, author_names):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        suspended = manga_indexer.suspended()
+        suspended.__enter__()
+        self.addCleanup(suspended.__exit__, None, None, None)
+        self.index_path = index_path
+        self.action = Genre.objects.create(name='Action')
+        self.drama = Genre.objects.create(name='Drama')
+        self.add_manga('Iron Path', 1984, 500, [self.action])
+        self.add_manga('Blue Garden', 1997, 300, [self.drama])
+        self.add_manga('Romance Dawn', None, 900, [self.action, self.drama])
+
+    def add_manga(self, title, release_year, views, genres, author_name='Tanaka'):
+        author, _ = Author.objects.get_or_create(name=author_name)
+        manga = Manga.objects.create(title=title, author=author, release_year=release_year, views=views, num_caps=1,
+                                     image_link='http://stand-in/cover.png', details_link='http://stand-in/manga')
+        manga.genres.set(genres)
+        return manga
+
+    def search(self, query=''):
+        return search_mangas(searcher_cache.searcher(), parse_filters(QueryDict(query)), '1')
+
+    def test_rebuild_is_seen_by_open_searchers(self):
+        index_all_mangas(self.index_path)
+        generation = searcher_cache.searcher().reader().generation()
+        self.search()
+        self.add_manga('Quiet Snow', 2021, 100, [self.drama])
+
+        index_all_mangas(self.index_path)
+
+        self.assertGreater(searcher_cache.searcher().reader().generation(), generation)
+        mangas, _ = self.search()
+        self.assertIn('Quiet Snow', [manga.title for manga in mangas])
+
+    def test_newest_first_lists_mangas_without_year_last(self):
+        index_all_mangas(self.index_path)
+
+        mangas, _ = self.search('sort=year')
+
+        self.assertEqual([manga.title for manga in mangas], ['Blue Garden', 'Iron Path', 'Romance Dawn'])
+
+    def test_facets_skip_mangas_without_year_and_ignore_their_own_filter(self):
+        index_all_mangas(self.index_path)
+
+        mangas, facets = self.search('genre=Action&start_year=1980&end_year=1989')
+
+        self.assertEqual([manga.title for manga in mangas], ['Iron Path'])
+        self.assertEqual(facets['genres'], {'Action': 1, 'Drama': 0})
+        self.assertEqual(facets['decades'], [(1980, 1)])
+        _, facets = self.search()
+        self.assertEqual(facets['decades'], [(1980, 1), (1990, 1)])
+
+    def test_autocomplete_suggests_new_authors_after_a_rebuild(self):
+        index_all_mangas(self.index_path)
+        self.assertEqual(autocomplete(searcher_cache.searcher(), 'ki'), {'titles': [], 'authors': []})
+        self.add_manga('Kind Words', 2001, 10, [self.drama], author_name='Kimura')
+
+        index_all_mangas(self.index_path)
+
+        suggestions = autocomplete(searcher_cache.searcher(), 'ki')
+        self.assertEqual(suggestions['authors'], ['Kimura'])
+        self.assertEqual([title['title'] for title in suggestions['titles']], ['Kind Words'])
+
+    def test_deleting_a_genre_reindexes_its_mangas(self):
+        mangas = set(self.drama.manga_set.values_list('pk', flat=True))
+
+        with mock.patch.object(manga_indexer, 'schedule_update') as schedule_update, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.drama.delete()
+
+        self.assertEqual({call.args[0] for call in schedule_update.call_args_list}, mangas)
+
+
+class StreamZipTests(TestCase):
+    """
+    Checks the ZIP archives streamed by the download API.
+    """
+
+    def test_archive_has_every_chapter(self):
+        pdfs = [('Chapter 1.pdf', BytesIO(b'%PDF 1')), ('Chapter 2.pdf', BytesIO(b'%PDF 2'))]
+
+        archive = zipfile.ZipFile(BytesIO(b''.join(stream_zip(pdfs))))
+
+        self.assertEqual(archive.namelist(), ['Chapter 1.pdf', 'Chapter 2.pdf'])
+        self.assertEqual(archive.read('Chapter 2.pdf'), b'%PDF 2')
+
+    def test_failed_chapter_interrupts_the_archive(self):
+        def pdfs():
+            yield 'Chapter 1.pdf', BytesIO(b'%PDF 1')
+            raise OSError('Chapter 2 failed')
+
+        chunks = []
+        with self.assertRaises(OSError):
+            for chunk in stream_zip(pdfs()):
+                chunks.append(chunk)
+
+        # Lo enviado hasta el fallo no es un ZIP válido, el cliente no lo confunde con una descarga completa
+        with self.assertRaises(zipfile.BadZipFile):
+            zipfile.ZipFile(BytesIO(b''.join(chunks)))
@@ -4,7 +4,11 @@ from apps.manga import views, api
 
 urlpatterns = [
     path('populate', views.populate_db, name='populate'),
+    path('populate_status/<int:job_id>', views.populate_status, name='populate_status'),
     path('list_all_mangas', views.list_all_mangas, name='list_all_mangas'),
+    path('autocomplete', views.autocomplete_mangas, name='autocomplete'),
+    path('search_stats', views.search_stats, name='search_stats'),
+    path('cache_stats', views.cache_stats, name='cache_stats'),
     path('details/<int:pk>', views.find_manga, name='find_manga'),
     path('download', api.MangaDownloadView.as_view(), name='download_manga'),
     path('list_all_chapters/<str:manga>', views.list_all_chapters, name='list_all_chapters'),
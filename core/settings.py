@@ -43,7 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'apps.home',  # Enable the inner home (home)
-    'apps.manga'
+    'apps.manga.config.MangaConfig'
 ]
 
 MIDDLEWARE = [
@@ -158,6 +158,9 @@ STATICFILES_DIRS = (
     os.path.join(CORE_DIR, 'apps/static'),
 )
 
+# Covers are stored under their content hash and never change, so browsers can cache them forever
+WHITENOISE_IMMUTABLE_FILE_TEST = r'/img/covers/[0-9a-f]{64}'
+
 
 #############################################################
 